@@ -6,41 +6,189 @@ Firmador de PDF Interactivo - VERSIÓN PROFESIONAL CORREGIDA
 - Selector de fecha con calendario y formatos desplegables
 - Botón X para eliminar, Shift para mantener proporción
 - CORRECCIÓN: Mapeo correcto de fuentes para exportación PDF
+- Modo por lotes sin interfaz:
+  python firmador.py --batch plantilla.json carpeta_entrada carpeta_salida
+- Caché opcional en disco de las páginas renderizadas:
+  python firmador.py --disk-cache [carpeta]
+- Reducción de las imágenes a la resolución de salida (modo por lotes):
+  python firmador.py --batch ... --image-dpi [ppp]
+- PyMuPDF, reportlab, PyPDF2 y tkcalendar se cargan al usarse por primera
+  vez; con la ventana ya abierta se precargan en segundo plano
+  (--no-warm-up lo desactiva)
+
+Esta es la vista de Tk; documento, elementos y exportación están en
+firmador_core, que no necesita pantalla.
 """
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, colorchooser
-from tkcalendar import Calendar
-from PIL import Image, ImageTk, ImageDraw
-import fitz
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from PyPDF2 import PdfReader, PdfWriter
-import io
+from PIL import Image, ImageTk
+import bisect
 import datetime
-import uuid
+import importlib
+import math
+import time
+import sys
+import threading
+import argparse
+
+from firmador_core import (
+    PAGE_CACHE_MB, TILE_SIZE, DISK_CACHE_MB, EXPORT_IMAGE_DPI, SIGNATURE_STROKE_WIDTH,
+    AssetStore, BitmapCache, DiskRenderCache, Element, ExportJob, PdfExporter, RenderWorker,
+    SignDocument, SpatialGrid, VectorSignature, default_cache_dir, disk_render_job, disk_render_key,
+    image_to_ppm, rasterize_strokes, render_page_bitmap, render_tile_bitmap, resample_from_pyramid,
+    run_batch, simplify_stroke, vector_image, warm_up)
+
+
+# Intervalo con el que Tk recoge resultados del worker de renderizado (ms)
+RENDER_POLL_MS = 15
+
+# Espera tras mostrar una página antes de precargar sus vecinas (ms)
+PREFETCH_DELAY_MS = 300
+
+# A partir de este zoom la página se renderiza por teselas visibles
+TILE_ZOOM_THRESHOLD = 2.0
+
+# Presupuesto de la caché de teselas (MB)
+TILE_CACHE_MB = 96
+
+# Fotogramas por segundo objetivo al aplicar arrastres y redimensionados
+MOTION_FPS = 60
+
+# Intervalo de refresco de la barra de progreso al guardar (ms)
+EXPORT_POLL_MS = 100
+
+# Ancho de las miniaturas de la barra lateral (píxeles)
+THUMB_WIDTH = 110
+
+# Margen alrededor de cada miniatura y alto reservado para su número (píxeles)
+THUMB_PAD = 8
+THUMB_LABEL_HEIGHT = 16
+
+# Presupuesto de la caché de miniaturas (MB)
+THUMB_CACHE_MB = 32
+
+# Separación vertical entre páginas en el modo de desplazamiento continuo (píxeles)
+PAGE_GAP = 16
+
+# Páginas que se mantienen dibujadas por encima y por debajo de la vista
+CONTINUOUS_MARGIN_PAGES = 1
+
+# Espera tras el último clic de zoom antes del renderizado nítido (ms)
+ZOOM_SETTLE_MS = 250
+
+# La vista previa se genera a 1/PREVIEW_FACTOR del tamaño final y Tk la amplía
+PREVIEW_FACTOR = 2
+
+# Píxeles como máximo de la vista previa en modo teselas; de ella se recorta
+# y amplía cada tesela visible mientras llega la nítida
+TILE_PREVIEW_PIXELS = 1000000
+
+# Puntos por item de línea mientras se dibuja: así cada evento cuesta lo mismo
+# aunque el trazo sea largo
+SIGNATURE_SEGMENT_POINTS = 64
+
+# Espera tras abrir la ventana antes de precargar en segundo plano lo que
+# hace falta para abrir y guardar PDF (ms)
+WARM_UP_DELAY_MS = 500
+
+
+class MotionScheduler:
+    """Aplica como mucho un evento de movimiento por fotograma.
+
+    Solo se conserva la última posición del puntero: los eventos que llegan
+    antes del siguiente fotograma sustituyen al pendiente y se cuentan como
+    fusionados.
+    """
+
+    def __init__(self, widget, fps=MOTION_FPS):
+        self.widget = widget
+        self.frame_ms = 1000.0 / fps
+        self.pending = None
+        self.after_id = None
+        self.last_applied = 0.0
+        self.received = 0
+        self.applied = 0
+        self.merged = 0
+
+    def set_fps(self, fps):
+        self.frame_ms = 1000.0 / fps
+
+    def post(self, callback, *args):
+        self.received += 1
+        if self.pending is not None:
+            self.merged += 1
+        self.pending = (callback, args)
+        if self.after_id is None:
+            elapsed = (time.perf_counter() - self.last_applied) * 1000
+            delay = int(self.frame_ms - elapsed)
+            if delay > 0:
+                self.after_id = self.widget.after(delay, self.flush)
+            else:
+                self.after_id = self.widget.after_idle(self.flush)
+
+    def flush(self):
+        """Aplica ya el evento pendiente (también al soltar el botón)"""
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+        if self.pending is None:
+            return
+        callback, args = self.pending
+        self.pending = None
+        self.last_applied = time.perf_counter()
+        self.applied += 1
+        callback(*args)
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'applied': self.applied,
+            'merged': self.merged,
+            'fps': 1000.0 / self.frame_ms,
+        }
+
+
+def model_property(name):
+    """Atributo de la vista que se lee y escribe en su Element"""
+    return property(lambda self: getattr(self.model, name),
+                    lambda self, value: setattr(self.model, name, value))
 
 
 class DraggableElement:
+    """Vista en el canvas de un Element del núcleo.
+
+    x, y, ancho, alto y tamaño de fuente son los del modelo, en puntos PDF
+    con origen arriba a la izquierda; en pantalla se dibujan con la
+    transformación de vista: origen de la página + punto * canvas.view_zoom.
+    """
+
+    x = model_property('x')
+    y = model_property('y')
+    width = model_property('width')
+    height = model_property('height')
+    content = model_property('content')
+    font_size = model_property('font_size')
+    font_family = model_property('font_family')
+    color = model_property('color')
+    element_type = model_property('element_type')
+    asset_id = model_property('asset_id')
+    page_num = model_property('page')
+    id = model_property('id')
+
     def __init__(self, canvas, x, y, element_type, content, **kwargs):
         self.canvas = canvas
-        self.x = x
-        self.y = y
-        self.element_type = element_type
-        self.content = content
-        self.width = kwargs.get('width', 150)
-        self.height = kwargs.get('height', 50)
-        self.font_size = kwargs.get('font_size', 12)
-        self.font_family = kwargs.get('font_family', 'Arial')
-        self.color = kwargs.get('color', '#000000')
+        self.model = Element(
+            element_type, None, x, y, kwargs.get('width', 150), kwargs.get('height', 50),
+            content=content if element_type == 'text' else None,
+            font_family=kwargs.get('font_family', 'Arial'), font_size=kwargs.get('font_size', 12),
+            color=kwargs.get('color', '#000000'))
         self.selected = False
         self.dragging = False
         self.resizing = False
         self.resize_handle_id = None
         self.offset_x = 0
         self.offset_y = 0
-        self.page_num = None
-        self.id = str(uuid.uuid4())
 
         self.original_width = self.width
         self.original_height = self.height
@@ -49,66 +197,67 @@ class DraggableElement:
         self.editing = False
         self.entry = None
 
+        # Imagen de origen compartida en el almacén y tamaño/calidad del último remuestreo
+        if element_type in ['image', 'signature']:
+            self.asset_id = canvas.asset_store.add(content)
+            if kwargs.get('vector') is not None:
+                canvas.asset_store.add_vector(self.asset_id, kwargs['vector'])
+        self.pyramid = None
+        self.rendered_size = None
+        self.rendered_fast = False
+
         self.create_visual()
 
+    def view_zoom(self):
+        return getattr(self.canvas, 'view_zoom', 1.0)
+
+    def screen_position(self):
+        """Esquina superior izquierda en coordenadas del canvas"""
+        zoom = self.view_zoom()
+        return (getattr(self, 'display_offset_x', 0) + self.x * zoom,
+                getattr(self, 'display_offset_y', 0) + self.y * zoom)
+
+    def screen_font(self):
+        # Tamaño negativo: píxeles, así el texto escala igual que la página
+        return (self.font_family, -max(1, round(self.font_size * self.view_zoom())))
+
+    def measure_text(self):
+        bbox = self.canvas.bbox(self.canvas_id)
+        if bbox:
+            zoom = self.view_zoom()
+            self.width = (bbox[2] - bbox[0]) / zoom
+            self.height = (bbox[3] - bbox[1]) / zoom
+
     def create_visual(self):
-        # Obtener offset de visualización si existe
-        offset_x = getattr(self, 'display_offset_x', 0)
-        offset_y = getattr(self, 'display_offset_y', 0)
-        
+        sx, sy = self.screen_position()
         if self.element_type == 'text':
             self.canvas_id = self.canvas.create_text(
-                self.x + offset_x, self.y + offset_y, text=self.content, font=(self.font_family, self.font_size),
+                sx, sy, text=self.content, font=self.screen_font(),
                 fill=self.color, anchor='nw', tags=('element', self.id)
             )
-            bbox = self.canvas.bbox(self.canvas_id)
-            if bbox:
-                self.width = bbox[2] - bbox[0]
-                self.height = bbox[3] - bbox[1]
+            self.measure_text()
         elif self.element_type in ['image', 'signature']:
             try:
-                if isinstance(self.content, str):
-                    img = Image.open(self.content)
-                else:
-                    img = self.content.copy()
-                img = img.resize((int(self.width), int(self.height)), Image.Resampling.LANCZOS)
-                self.photo = ImageTk.PhotoImage(img)
+                self.rendered_size = None
+                self.render_image(fast=False)
                 self.canvas_id = self.canvas.create_image(
-                    self.x + offset_x, self.y + offset_y, image=self.photo, anchor='nw', tags=('element', self.id)
+                    sx, sy, image=self.photo, anchor='nw', tags=('element', self.id)
                 )
             except Exception as e:
                 print(f"Error imagen: {e}")
                 return
 
-        # Marco selección
-        self.selection_rect = self.canvas.create_rectangle(0, 0, 0, 0,
-            outline='#0078d7', width=2, dash=(4, 4), state='hidden', tags=('select', self.id))
+        # Los eventos los reparte PDFSignerGUI a partir del índice espacial;
+        # el marco de selección y los manejadores son compartidos (SelectionOverlay)
+        self.update_index()
 
-        # Botón X
-        self.delete_button = self.canvas.create_oval(0, 0, 0, 0, fill='red', outline='white', width=2, state='hidden', tags=('delete', self.id))
-        self.delete_text = self.canvas.create_text(0, 0, text='X', fill='white', font=('Arial', 10, 'bold'), state='hidden', tags=('delete', self.id))
+    def page_bbox(self):
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
 
-        # 8 manejadores con diseño mejorado
-        self.resize_handles = []
-        for i in range(8):
-            h = self.canvas.create_oval(0, 0, 0, 0, fill='white', outline='#0078d7', width=2, state='hidden', tags=('handle', self.id))
-            self.resize_handles.append(h)
-
-        self.update_selection()
-
-        # Eventos
-        self.canvas.tag_bind(self.canvas_id, '<Button-1>', self.on_press)
-        self.canvas.tag_bind(self.canvas_id, '<B1-Motion>', self.on_drag)
-        self.canvas.tag_bind(self.canvas_id, '<ButtonRelease-1>', self.on_release)
-        self.canvas.tag_bind(self.canvas_id, '<Double-Button-1>', self.start_edit)
-
-        self.canvas.tag_bind(self.delete_button, '<Button-1>', self.on_delete)
-        self.canvas.tag_bind(self.delete_text, '<Button-1>', self.on_delete)
-
-        for i, h in enumerate(self.resize_handles):
-            self.canvas.tag_bind(h, '<Button-1>', lambda e, idx=i: self.start_resize(e, idx))
-            self.canvas.tag_bind(h, '<B1-Motion>', lambda e, idx=i: self.do_resize(e, idx))
-            self.canvas.tag_bind(h, '<ButtonRelease-1>', self.stop_resize)
+    def update_index(self):
+        index = getattr(self.canvas, 'spatial_index', None)
+        if index is not None and self in index:
+            index.update(self, self.page_bbox())
 
     def start_edit(self, event):
         if self.element_type != 'text' or self.editing:
@@ -118,7 +267,7 @@ class DraggableElement:
         if not bbox:
             return
         x1, y1, x2, y2 = bbox
-        self.entry = tk.Entry(self.canvas, font=(self.font_family, self.font_size), fg=self.color, relief='flat', bd=0)
+        self.entry = tk.Entry(self.canvas, font=self.screen_font(), fg=self.color, relief='flat', bd=0)
         self.entry.insert(0, self.content)
         self.entry.select_range(0, 'end')
         self.entry.focus()
@@ -142,10 +291,6 @@ class DraggableElement:
         self.entry.bind('<FocusOut>', commit_edit)
         self.entry.bind('<Escape>', cancel_edit)
 
-    def on_delete(self, event):
-        self.delete()
-        return "break"
-
     def start_resize(self, event, idx):
         self.resizing = True
         self.resize_handle_id = idx
@@ -159,11 +304,30 @@ class DraggableElement:
         self.select()
         return "break"
 
+    def post_motion(self, callback, *args):
+        scheduler = getattr(self.canvas, 'motion_scheduler', None)
+        if scheduler is None:
+            callback(*args)
+        else:
+            scheduler.post(callback, *args)
+
+    def flush_motion(self):
+        scheduler = getattr(self.canvas, 'motion_scheduler', None)
+        if scheduler is not None:
+            scheduler.flush()
+
     def do_resize(self, event, idx):
         if not self.resizing:
             return
-        dx = event.x - self.resize_start_x
-        dy = event.y - self.resize_start_y
+        self.post_motion(self.apply_resize, event.x, event.y, event.state, idx)
+
+    def apply_resize(self, x, y, state, idx):
+        if not self.resizing:
+            return
+        # El desplazamiento del ratón está en píxeles; el tamaño, en puntos
+        zoom = self.view_zoom()
+        dx = (x - self.resize_start_x) / zoom
+        dy = (y - self.resize_start_y) / zoom
 
         # Determinar qué bordes se están moviendo
         # 0: top-left, 1: top-center, 2: top-right
@@ -178,7 +342,7 @@ class DraggableElement:
         new_w, new_h = self.start_width, self.start_height
 
         # Detectar si Shift está presionado para mantener proporción
-        shift_pressed = (event.state & 0x0001) != 0
+        shift_pressed = (state & 0x0001) != 0
 
         if self.element_type in ['image', 'signature'] and shift_pressed:
             # Mantener proporción para imágenes/firmas con Shift
@@ -222,14 +386,17 @@ class DraggableElement:
             scale = min(scale_w, scale_h)
             self.font_size = max(8, int(self.start_font_size * scale))
 
-        self.update_visual()
+        self.update_visual(fast=True)
         self.update_selection()
 
     def stop_resize(self, event):
+        self.flush_motion()
         self.resizing = False
         if self.element_type in ['image', 'signature']:
             self.original_width = self.width
             self.original_height = self.height
+            # Pasada final de calidad una vez soltado el botón
+            self.update_visual()
 
     def on_press(self, event):
         if self.resizing:
@@ -237,73 +404,225 @@ class DraggableElement:
         self.dragging = True
         self.select()
         
-        # Obtener offset de visualización
-        offset_x = getattr(self, 'display_offset_x', 0)
-        offset_y = getattr(self, 'display_offset_y', 0)
-        
-        self.offset_x = event.x - (self.x + offset_x)
-        self.offset_y = event.y - (self.y + offset_y)
+        # Punto de agarre dentro del elemento, en puntos de la página
+        zoom = self.view_zoom()
+        self.offset_x = event.x / zoom - self.x
+        self.offset_y = event.y / zoom - self.y
         self.canvas.tag_raise(self.canvas_id)
-        self.canvas.tag_raise(self.selection_rect)
-        self.canvas.tag_raise(self.delete_button)
-        self.canvas.tag_raise(self.delete_text)
-        for h in self.resize_handles:
-            self.canvas.tag_raise(h)
+        self.canvas.spatial_index.raise_item(self)
+        self.canvas.selection_overlay.raise_items()
         return "break"
 
     def on_drag(self, event):
         if self.dragging and not self.resizing:
-            offset_x = getattr(self, 'display_offset_x', 0)
-            offset_y = getattr(self, 'display_offset_y', 0)
-            
-            # Actualizar posición real (sin offset)
-            self.x = event.x - self.offset_x - offset_x
-            self.y = event.y - self.offset_y - offset_y
+            self.post_motion(self.apply_drag, event.x, event.y)
+
+    def apply_drag(self, x, y):
+        if self.dragging and not self.resizing:
+            zoom = self.view_zoom()
+            self.x = x / zoom - self.offset_x
+            self.y = y / zoom - self.offset_y
             self.update_visual()
             self.update_selection()
 
     def on_release(self, event):
+        self.flush_motion()
         self.dragging = False
+        if self.rendered_fast:
+            self.update_visual()
 
-    def update_visual(self):
-        offset_x = getattr(self, 'display_offset_x', 0)
-        offset_y = getattr(self, 'display_offset_y', 0)
-        
-        self.canvas.coords(self.canvas_id, self.x + offset_x, self.y + offset_y)
+    def update_visual(self, fast=False):
+        """Recoloca el item existente con la transformación de vista actual.
+
+        Sirve tanto al mover como al cambiar el zoom: el texto solo cambia de
+        tamaño de fuente y las imágenes se remuestrean si cambió su tamaño.
+        """
+        self.canvas.coords(self.canvas_id, *self.screen_position())
         if self.element_type == 'text':
             self.canvas.itemconfig(self.canvas_id, text=self.content,
-                                 font=(self.font_family, self.font_size), fill=self.color)
-            bbox = self.canvas.bbox(self.canvas_id)
-            if bbox:
-                self.width = bbox[2] - bbox[0]
-                self.height = bbox[3] - bbox[1]
+                                 font=self.screen_font(), fill=self.color)
+            self.measure_text()
         elif self.element_type in ['image', 'signature']:
             try:
-                if isinstance(self.content, str):
-                    img = Image.open(self.content)
-                else:
-                    img = self.content.copy()
-                img = img.resize((int(self.width), int(self.height)), Image.Resampling.LANCZOS)
-                self.photo = ImageTk.PhotoImage(img)
-                self.canvas.itemconfig(self.canvas_id, image=self.photo)
+                # Mover no cambia el tamaño: solo se remuestrea si hace falta
+                if self.render_image(fast):
+                    self.canvas.itemconfig(self.canvas_id, image=self.photo)
             except Exception as e:
                 print(f"Error: {e}")
+        self.update_index()
+
+    def render_image(self, fast):
+        """Remuestrea la imagen al tamaño en pantalla; devuelve False si no hizo falta"""
+        zoom = self.view_zoom()
+        size = (max(1, int(self.width * zoom)), max(1, int(self.height * zoom)))
+        if size == self.rendered_size and (fast or not self.rendered_fast):
+            return False
+        vector = self.canvas.asset_store.vectors.get(self.asset_id)
+        if vector is not None and not fast:
+            # Una firma dibujada se rasteriza de nuevo a su tamaño: nítida a cualquier zoom
+            img = vector_image(vector, size)
+        else:
+            if self.pyramid is None:
+                self.pyramid = self.canvas.asset_store.pyramid(self.asset_id)
+            img = resample_from_pyramid(self.pyramid, size, fast)
+        self.photo = ImageTk.PhotoImage(img)
+        self.rendered_size = size
+        self.rendered_fast = fast
+        return True
 
     def update_selection(self):
-        bbox = self.canvas.bbox(self.canvas_id)
+        overlay = self.canvas.selection_overlay
+        if overlay.element is self:
+            overlay.place()
+
+    def select(self):
+        self.canvas.selection_overlay.attach(self)
+        self.canvas.master_element = self
+
+    def deselect(self):
+        overlay = self.canvas.selection_overlay
+        if overlay.element is self:
+            overlay.detach()
+        elif self in overlay.group:
+            overlay.discard(self)
+        self.selected = False
+
+    def delete(self):
+        self.deselect()
+        items = self.canvas.find_withtag(self.id)
+        for item in items:
+            self.canvas.delete(item)
+        if hasattr(self.canvas, 'master_element') and self.canvas.master_element == self:
+            del self.canvas.master_element
+
+
+class SelectionOverlay:
+    """Marco de selección, botón X y 8 manejadores compartidos.
+
+    Hay un solo juego de items en el canvas que se coloca sobre el elemento
+    seleccionado, así cada elemento ocupa un único item. Los bindings se
+    hacen por etiqueta y sobreviven a que se borre y recree el canvas.
+    """
+
+    PAD = 4
+    BUTTON_SIZE = 16
+    HANDLE_SIZE = 8
+
+    def __init__(self, canvas, on_delete):
+        self.canvas = canvas
+        self.on_delete = on_delete
+        self.element = None
+        self.group = []
+        self.create_items()
+
+        canvas.tag_bind('overlay_delete', '<Button-1>', self.delete_clicked)
+        for i in range(8):
+            tag = f'overlay_handle{i}'
+            canvas.tag_bind(tag, '<Button-1>', lambda e, idx=i: self.handle_event('start_resize', e, idx))
+            canvas.tag_bind(tag, '<B1-Motion>', lambda e, idx=i: self.handle_event('do_resize', e, idx))
+            canvas.tag_bind(tag, '<ButtonRelease-1>', lambda e: self.handle_event('stop_resize', e))
+
+    def create_items(self):
+        """(Re)crea los items ocultos, p. ej. tras canvas.delete("all")"""
+        self.element = None
+        self.group = []
+        # Marco de una selección múltiple
+        self.canvas.create_rectangle(0, 0, 0, 0, outline='#0078d7', width=1, dash=(2, 2),
+                                     state='hidden', tags=('overlay_group',))
+        # Marco selección
+        self.canvas.create_rectangle(0, 0, 0, 0, outline='#0078d7', width=2, dash=(4, 4),
+                                     state='hidden', tags=('overlay', 'overlay_select'))
+
+        # Botón X
+        self.canvas.create_oval(0, 0, 0, 0, fill='red', outline='white', width=2,
+                                state='hidden', tags=('overlay', 'overlay_delete', 'overlay_button'))
+        self.canvas.create_text(0, 0, text='X', fill='white', font=('Arial', 10, 'bold'),
+                                state='hidden', tags=('overlay', 'overlay_delete', 'overlay_label'))
+
+        # 8 manejadores con diseño mejorado
+        for i in range(8):
+            self.canvas.create_oval(0, 0, 0, 0, fill='white', outline='#0078d7', width=2,
+                                    state='hidden', tags=('overlay', f'overlay_handle{i}'))
+
+    def attach(self, element):
+        self.clear_group()
+        if self.element is not None and self.element is not element:
+            self.element.selected = False
+        self.element = element
+        element.selected = True
+        self.place()
+        self.canvas.itemconfig('overlay', state='normal')
+        self.raise_items()
+
+    def detach(self):
+        self.clear_group()
+        if self.element is not None:
+            self.element.selected = False
+        self.element = None
+        self.canvas.itemconfig('overlay', state='hidden')
+
+    def raise_items(self):
+        self.canvas.tag_raise('overlay')
+
+    def set_group(self, elements):
+        """Selecciona varios elementos a la vez con un único marco común"""
+        self.detach()
+        if len(elements) == 1:
+            elements[0].select()
+            return
+        self.group = list(elements)
+        for elem in self.group:
+            elem.selected = True
+        if self.group:
+            self.place_group()
+            self.canvas.itemconfig('overlay_group', state='normal')
+            self.canvas.tag_raise('overlay_group')
+
+    def clear_group(self):
+        for elem in self.group:
+            elem.selected = False
+        self.group = []
+        self.canvas.itemconfig('overlay_group', state='hidden')
+
+    def discard(self, element):
+        """Quita un elemento de la selección múltiple, p. ej. al borrarlo"""
+        self.group.remove(element)
+        element.selected = False
+        if self.group:
+            self.place_group()
+        else:
+            self.clear_group()
+
+    def place_group(self):
+        boxes = [self.canvas.bbox(elem.canvas_id) for elem in self.group]
+        boxes = [b for b in boxes if b]
+        if not boxes:
+            return
+        pad = self.PAD
+        self.canvas.coords('overlay_group',
+                           min(b[0] for b in boxes) - pad, min(b[1] for b in boxes) - pad,
+                           max(b[2] for b in boxes) + pad, max(b[3] for b in boxes) + pad)
+
+    def selection(self):
+        if self.group:
+            return list(self.group)
+        return [self.element] if self.element is not None else []
+
+    def place(self):
+        bbox = self.canvas.bbox(self.element.canvas_id)
         if not bbox:
             return
-        pad = 4
+        pad = self.PAD
         x1, y1, x2, y2 = bbox
-        self.canvas.coords(self.selection_rect, x1-pad, y1-pad, x2+pad, y2+pad)
+        self.canvas.coords('overlay_select', x1-pad, y1-pad, x2+pad, y2+pad)
 
         # Botón X
-        btn = 16
-        self.canvas.coords(self.delete_button, x2-pad-btn, y1-pad-btn, x2-pad, y1-pad)
-        self.canvas.coords(self.delete_text, x2-pad-btn//2, y1-pad-btn//2)
+        btn = self.BUTTON_SIZE
+        self.canvas.coords('overlay_button', x2-pad-btn, y1-pad-btn, x2-pad, y1-pad)
+        self.canvas.coords('overlay_label', x2-pad-btn//2, y1-pad-btn//2)
 
         # 8 manejadores (círculos blancos con borde azul)
-        hs = 8  # Tamaño de los manejadores
+        hs = self.HANDLE_SIZE
         positions = [
             (x1-pad-hs//2, y1-pad-hs//2),           # 0: top-left
             ((x1+x2)//2-hs//2, y1-pad-hs//2),       # 1: top-center
@@ -315,47 +634,214 @@ class DraggableElement:
             (x1-pad-hs//2, (y1+y2)//2-hs//2),       # 7: middle-left
         ]
         for i, (hx, hy) in enumerate(positions):
-            h = self.resize_handles[i]
-            self.canvas.coords(h, hx, hy, hx+hs, hy+hs)
+            self.canvas.coords(f'overlay_handle{i}', hx, hy, hx+hs, hy+hs)
 
-    def select(self):
-        for elem in self.canvas.elements:
-            if elem != self and elem.selected:
-                elem.deselect()
-        self.selected = True
-        self.canvas.itemconfig(self.selection_rect, state='normal')
-        self.canvas.itemconfig(self.delete_button, state='normal')
-        self.canvas.itemconfig(self.delete_text, state='normal')
-        for h in self.resize_handles:
-            self.canvas.itemconfig(h, state='normal')
-        self.canvas.master_element = self
+    def handle_event(self, method, event, *args):
+        if self.element is not None:
+            return getattr(self.element, method)(event, *args)
 
-    def deselect(self):
-        self.selected = False
-        self.canvas.itemconfig(self.selection_rect, state='hidden')
-        self.canvas.itemconfig(self.delete_button, state='hidden')
-        self.canvas.itemconfig(self.delete_text, state='hidden')
-        for h in self.resize_handles:
-            self.canvas.itemconfig(h, state='hidden')
+    def delete_clicked(self, event):
+        if self.element is not None:
+            self.on_delete(self.element)
+        return "break"
 
-    def delete(self):
-        items = self.canvas.find_withtag(self.id)
-        for item in items:
-            self.canvas.delete(item)
-        if hasattr(self.canvas, 'master_element') and self.canvas.master_element == self:
-            del self.canvas.master_element
+
+class ThumbnailStrip:
+    """Barra lateral de miniaturas de página con desplazamiento virtualizado.
+
+    Solo existen items en el canvas para las miniaturas que caen en la zona
+    visible. Se rasterizan a baja resolución en un worker propio (con el
+    cerrojo de MuPDF del visor) y se guardan en su propia caché limitada.
+    Las páginas con elementos llevan una marca; un clic salta a la página.
+    """
+
+    def __init__(self, parent, lock, on_select, cache_mb=THUMB_CACHE_MB, disk_cache=None):
+        self.on_select = on_select
+        self.disk_cache = disk_cache
+        self.frame = ttk.Frame(parent, relief=tk.SUNKEN, borderwidth=1)
+        self.scroll = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.on_yscroll)
+        self.scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas = tk.Canvas(self.frame, width=THUMB_WIDTH + THUMB_PAD * 2, bg='#3a3a3a',
+                                yscrollcommand=self.scroll.set, highlightthickness=0)
+        self.canvas.pack(side=tk.LEFT, fill=tk.Y, expand=True)
+        self.worker = RenderWorker(lock)
+        self.cache = BitmapCache(cache_mb)
+        self.document = None
+        self.doc_key = None
+        self.content_hash = None
+        self.zooms = []
+        self.heights = []
+        # Coordenada y de cada hueco; el último valor es el alto total
+        self.tops = [0]
+        self.drawn = {}
+        self.marked = set()
+        self.current = None
+        self.update_after_id = None
+
+        self.canvas.bind('<Configure>', lambda e: self.schedule_update())
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<MouseWheel>', self.on_mousewheel)
+        self.canvas.bind('<Button-4>', self.on_mousewheel)
+        self.canvas.bind('<Button-5>', self.on_mousewheel)
+
+    def load(self, document, doc_key, page_sizes, content_hash=None):
+        """Prepara los huecos de un documento nuevo sin renderizar nada aún"""
+        self.worker.cancel()
+        self.canvas.delete('all')
+        self.document = document
+        self.doc_key = doc_key
+        self.content_hash = content_hash
+        self.drawn = {}
+        self.marked = set()
+        self.current = None
+        self.zooms = [THUMB_WIDTH / pw for pw, _ in page_sizes]
+        self.heights = [max(1, int(ph * zoom)) for (_, ph), zoom in zip(page_sizes, self.zooms)]
+        self.tops = [0]
+        for height in self.heights:
+            self.tops.append(self.tops[-1] + height + THUMB_LABEL_HEIGHT + THUMB_PAD * 2)
+        self.canvas.config(scrollregion=(0, 0, THUMB_WIDTH + THUMB_PAD * 2, self.tops[-1]))
+        self.canvas.yview_moveto(0)
+        self.schedule_update()
+
+    def on_yscroll(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_update()
+
+    def on_mousewheel(self, event):
+        if event.num == 5 or event.delta < 0:
+            self.canvas.yview_scroll(1, "units")
+        elif event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, "units")
+        self.schedule_update()
+
+    def on_click(self, event):
+        index = self.slot_at(self.canvas.canvasy(event.y))
+        if index is not None:
+            self.on_select(index)
+
+    def slot_at(self, y):
+        if not self.heights or y < 0 or y >= self.tops[-1]:
+            return None
+        return bisect.bisect_right(self.tops, y) - 1
+
+    def schedule_update(self):
+        if self.update_after_id is None and self.document is not None:
+            self.update_after_id = self.canvas.after_idle(self.update_visible)
+
+    def update_visible(self):
+        """Crea los huecos visibles, borra los demás y pide las miniaturas que faltan"""
+        self.update_after_id = None
+        if self.document is None:
+            return
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        # Un hueco de margen por cada lado para que el scroll no muestre huecos vacíos
+        first = max(0, bisect.bisect_right(self.tops, top) - 2)
+        last = min(len(self.heights) - 1, bisect.bisect_left(self.tops, bottom) + 1)
+        visible = range(first, last + 1)
+
+        for index in list(self.drawn):
+            if index not in visible:
+                self.canvas.delete(f'thumb{index}')
+                del self.drawn[index]
+
+        # Las miniaturas que salieron de la vista ya no se renderizan
+        self.worker.cancel()
+        for index in visible:
+            if index not in self.drawn:
+                self.draw_slot(index)
+            if self.drawn[index] is None:
+                key = (self.doc_key, index)
+                photo = self.cache.get(key)
+                if photo is not None:
+                    self.show(index, photo)
+                else:
+                    func, args = disk_render_job(self.disk_cache, self.content_hash, render_page_bitmap,
+                                                 (self.document, index, self.zooms[index]))
+                    self.worker.submit(key, func, args, RenderWorker.PRIORITY_VISIBLE)
+
+    def draw_slot(self, index):
+        tag = f'thumb{index}'
+        x, y = THUMB_PAD, self.tops[index] + THUMB_PAD
+        outline = '#0078d7' if index == self.current else '#1a1a1a'
+        self.canvas.create_rectangle(x - 2, y - 2, x + THUMB_WIDTH + 2, y + self.heights[index] + 2,
+                                     fill='white', outline=outline, width=2, tags=(tag, f'frame{index}'))
+        self.canvas.create_text(x + THUMB_WIDTH // 2, y + self.heights[index] + THUMB_LABEL_HEIGHT // 2 + 2,
+                                text=str(index + 1), fill='#dddddd', font=('Arial', 8), tags=(tag,))
+        self.drawn[index] = None
+        if index in self.marked:
+            self.draw_mark(index)
+
+    def draw_mark(self, index):
+        x, y = THUMB_PAD + THUMB_WIDTH - 16, self.tops[index] + THUMB_PAD + 4
+        self.canvas.create_oval(x, y, x + 12, y + 12, fill='#0078d7', outline='white',
+                                tags=(f'thumb{index}', f'mark{index}'))
+
+    def show(self, index, photo):
+        item = self.canvas.create_image(THUMB_PAD, self.tops[index] + THUMB_PAD, image=photo,
+                                        anchor='nw', tags=(f'thumb{index}',))
+        self.canvas.tag_raise(item, f'frame{index}')
+        self.drawn[index] = photo
+
+    def set_current(self, index):
+        """Resalta la página mostrada y la trae a la vista si no se ve"""
+        if self.current is not None:
+            self.canvas.itemconfig(f'frame{self.current}', outline='#1a1a1a')
+        self.current = index
+        self.canvas.itemconfig(f'frame{index}', outline='#0078d7')
+        if not self.heights:
+            return
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        if self.tops[index] < top or self.tops[index + 1] > bottom:
+            self.canvas.yview_moveto(self.tops[index] / self.tops[-1])
+            self.schedule_update()
+
+    def set_marked(self, pages):
+        """Marca las páginas que tienen elementos colocados"""
+        pages = set(pages)
+        for index in self.marked - pages:
+            self.canvas.delete(f'mark{index}')
+        for index in pages - self.marked:
+            if index in self.drawn:
+                self.draw_mark(index)
+        self.marked = pages
+
+    def poll(self):
+        """Recoge las miniaturas terminadas; se llama desde el hilo de Tk"""
+        for key, bitmap, error in self.worker.drain():
+            if error is not None:
+                print(f"Error al renderizar miniatura {key}: {error}")
+                continue
+            ppm, width, height = bitmap
+            photo = tk.PhotoImage(master=self.canvas, data=ppm, format='PPM')
+            self.cache.put(key, photo, width * height * 4)
+            doc_key, index = key
+            if doc_key == self.doc_key and index in self.drawn and self.drawn[index] is None:
+                self.show(index, photo)
+
+    def shutdown(self):
+        self.worker.shutdown()
 
 
 class SignatureDrawer:
+    """Ventana para dibujar la firma con el ratón.
+
+    Cada trazo se guarda como lista de puntos (x, y, t) y se muestra con
+    pocos items de línea actualizados con coords; al soltar el botón se
+    simplifica y la imagen solo se rasteriza al aceptar.
+    """
+
     def __init__(self, canvas, callback):
         self.canvas = canvas
         self.callback = callback
         self.drawing = False
-        self.last_x = 0
-        self.last_y = 0
-        self.lines = []
-        self.img = Image.new("RGBA", (440, 200), (255, 255, 255, 0))
-        self.draw = ImageDraw.Draw(self.img)
+        self.size = (440, 200)
+        # Trazos terminados (ya simplificados) y el que se está dibujando
+        self.strokes = []
+        self.stroke = None
+        self.stroke_items = []
+        self.items = []
 
         self.window = tk.Toplevel(canvas.master)
         self.window.title("Dibujar Firma")
@@ -370,14 +856,20 @@ class SignatureDrawer:
         self.window.geometry(f'480x320+{x}+{y}')
 
         # Instrucciones
-        ttk.Label(self.window, text="Dibuja tu firma con el ratón:", 
-                 font=('Arial', 11)).pack(pady=8)
+        top_frame = ttk.Frame(self.window)
+        top_frame.pack(fill=tk.X, padx=20, pady=8)
+        ttk.Label(top_frame, text="Dibuja tu firma con el ratón:", 
+                 font=('Arial', 11)).pack(side=tk.LEFT)
+        self.variable_width_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top_frame, text="Grosor según velocidad",
+                        variable=self.variable_width_var).pack(side=tk.RIGHT)
 
         # Canvas de dibujo con borde
         canvas_frame = ttk.Frame(self.window, relief='solid', borderwidth=1)
         canvas_frame.pack(padx=15, pady=8)
         
-        self.draw_canvas = tk.Canvas(canvas_frame, width=440, height=200, bg='white', cursor='crosshair')
+        self.draw_canvas = tk.Canvas(canvas_frame, width=self.size[0], height=self.size[1], bg='white',
+                                     cursor='crosshair')
         self.draw_canvas.pack()
 
         # Botones
@@ -395,42 +887,74 @@ class SignatureDrawer:
         # Evento para cerrar ventana
         self.window.protocol("WM_DELETE_WINDOW", self.cancel)
 
+    def create_stroke_item(self, coords):
+        return self.draw_canvas.create_line(
+            *coords, width=SIGNATURE_STROKE_WIDTH, fill='black', capstyle=tk.ROUND,
+            smooth=True, joinstyle=tk.ROUND
+        )
+
     def start_draw(self, event):
         self.drawing = True
-        self.last_x, self.last_y = event.x, event.y
+        self.stroke = [(event.x, event.y, event.time)]
+        self.segment_start = 0
+        self.stroke_items = [self.create_stroke_item((event.x, event.y, event.x, event.y))]
 
     def draw_line(self, event):
-        if self.drawing:
-            x, y = event.x, event.y
-            line = self.draw_canvas.create_line(
-                self.last_x, self.last_y, x, y, 
-                width=3, fill='black', capstyle=tk.ROUND, 
-                smooth=True, joinstyle=tk.ROUND
-            )
-            self.lines.append(line)
-            self.draw.line([self.last_x, self.last_y, x, y], fill=(0, 0, 0, 255), width=3)
-            self.last_x, self.last_y = x, y
+        if not self.drawing:
+            return
+        x, y = event.x, event.y
+        if (x, y) == self.stroke[-1][:2]:
+            return
+        self.stroke.append((x, y, event.time))
+        if len(self.stroke) - self.segment_start > SIGNATURE_SEGMENT_POINTS:
+            # El item actual ya es largo: se sigue en otro que empieza en su último punto
+            self.segment_start = len(self.stroke) - 2
+            self.stroke_items.append(self.create_stroke_item((0, 0, 0, 0)))
+        coords = [c for px, py, _ in self.stroke[self.segment_start:] for c in (px, py)]
+        if len(coords) == 2:
+            coords *= 2
+        self.draw_canvas.coords(self.stroke_items[-1], *coords)
 
     def stop_draw(self, event):
+        if not self.drawing:
+            return
         self.drawing = False
+        # Al terminar el trazo sus items se sustituyen por uno solo simplificado
+        points = simplify_stroke(self.stroke)
+        for item in self.stroke_items:
+            self.draw_canvas.delete(item)
+        coords = [c for px, py, _ in points for c in (px, py)]
+        if len(coords) == 2:
+            coords *= 2
+        self.items.append(self.create_stroke_item(coords))
+        self.strokes.append(points)
+        self.stroke = None
+        self.stroke_items = []
 
     def clear(self):
-        for line in self.lines:
-            self.draw_canvas.delete(line)
-        self.lines = []
-        self.img = Image.new("RGBA", (440, 200), (255, 255, 255, 0))
-        self.draw = ImageDraw.Draw(self.img)
+        for item in self.items + self.stroke_items:
+            self.draw_canvas.delete(item)
+        self.items = []
+        self.strokes = []
+        self.stroke = None
+        self.stroke_items = []
+        self.drawing = False
 
     def accept(self):
-        if not self.lines:
+        if not self.strokes:
             messagebox.showwarning("Advertencia", "Por favor dibuja una firma antes de aceptar")
             return
         
-        # Recortar imagen al contenido real
-        bbox = self.img.getbbox()
+        # Rasterizar una sola vez y recortar la imagen al contenido real
+        variable_width = self.variable_width_var.get()
+        img = rasterize_strokes(self.strokes, self.size, variable_width)
+        bbox = img.getbbox()
         if bbox:
-            cropped = self.img.crop(bbox)
-            self.callback(cropped)
+            cropped = img.crop(bbox)
+            # Los trazos acompañan a la imagen para exportarlos como vectores
+            left, top = bbox[:2]
+            strokes = [[(x - left, y - top, t) for x, y, t in points] for points in self.strokes]
+            self.callback(cropped, VectorSignature(cropped.width, cropped.height, strokes, variable_width))
             self.window.destroy()
         else:
             messagebox.showwarning("Advertencia", "No se detectó ninguna firma")
@@ -440,20 +964,68 @@ class SignatureDrawer:
 
 
 class PDFSignerGUI:
-    def __init__(self, root):
+    def __init__(self, root, cache_mb=PAGE_CACHE_MB, motion_fps=MOTION_FPS, disk_cache_dir=None,
+                 disk_cache_mb=DISK_CACHE_MB, warm_up=True):
         self.root = root
         self.root.title("Firmador de PDF Profesional")
         self.root.geometry("1400x900")
 
         self.pdf_path = None
+        # Documento y elementos (núcleo); self.elements son sus vistas en el canvas
+        self.session = None
+        self.document = None
         self.pdf_document = None
         self.current_page = 0
         self.total_pages = 0
         self.elements = []
+        self.page_indexes = {}
+        self.asset_store = AssetStore()
+        self.pressed_element = None
+        self.group_drag = None
+        self.rubber_band = None
         self.zoom_level = 1.0
         self.current_color = '#000000'
+        self.doc_key = None
+        self.page_sizes = []
+        self.shadow_offset = 10
+        self.page_cache = BitmapCache(cache_mb)
+        self.tile_cache = BitmapCache(TILE_CACHE_MB)
+        self.drawn_tiles = {}
+        # Teselas provisionales recortadas de la vista previa: celda -> (item, foto)
+        self.preview_tiles = {}
+        # ((doc_key, página), imagen PIL) de la vista previa limitada del modo teselas
+        self.tile_preview = None
+        self.view_after_id = None
+        self.continuous = False
+        self.page_tops = []
+        self.scroll_height = 0
+        self.drawn_pages = {}
+        self.page_previews = {}
+        self.zoom_after_id = None
+        self.render_worker = RenderWorker()
+        # Caché en disco opcional: documentos ya vistos no se vuelven a rasterizar
+        self.disk_cache = DiskRenderCache(disk_cache_dir, disk_cache_mb) if disk_cache_dir else None
+        self.exporter = PdfExporter(self.asset_store, self.render_worker.lock)
+        self.visible_key = None
+        self.prefetch_after_id = None
+        self.motion_fps = motion_fps
+        self.export_job = None
+        # Imágenes retenidas mientras dura el guardado
+        self.export_assets = []
 
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(RENDER_POLL_MS, self.poll_render_results)
+        if warm_up:
+            self.root.after(WARM_UP_DELAY_MS, self.start_warm_up)
+
+    def start_warm_up(self):
+        """Importa PyMuPDF, el exportador y el calendario sin bloquear la ventana;
+        si se usan antes de que termine, el import espera al hilo"""
+        def run():
+            warm_up()
+            importlib.import_module('tkcalendar')
+        threading.Thread(target=run, daemon=True).start()
 
     def setup_ui(self):
         # Barra superior con botones principales
@@ -524,6 +1096,13 @@ class PDFSignerGUI:
         self.color_indicator = tk.Canvas(left_panel, height=30, bg=self.current_color, relief=tk.SUNKEN, borderwidth=2)
         self.color_indicator.pack(fill=tk.X, padx=5, pady=5)
 
+        self.incremental_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(left_panel, text="Guardado incremental\n(solo páginas editadas)",
+                        variable=self.incremental_var).pack(anchor=tk.W, padx=5, pady=(15, 0))
+        self.downsample_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(left_panel, text=f"Reducir imágenes\n(a {EXPORT_IMAGE_DPI} ppp)",
+                        variable=self.downsample_var).pack(anchor=tk.W, padx=5, pady=(5, 0))
+
         ttk.Label(left_panel, text="Zoom:").pack(anchor=tk.W, padx=5, pady=(20, 0))
         zoom_frame = ttk.Frame(left_panel)
         zoom_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -546,6 +1125,11 @@ class PDFSignerGUI:
         """
         ttk.Label(help_frame, text=help_text, justify=tk.LEFT, font=('Arial', 8)).pack(padx=5, pady=5)
 
+        # Miniaturas de las páginas: un clic salta a la página
+        self.thumbnails = ThumbnailStrip(main_frame, self.render_worker.lock, self.go_to_page,
+                                         disk_cache=self.disk_cache)
+        self.thumbnails.frame.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 5))
+
         center_panel = ttk.Frame(main_frame)
         center_panel.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
@@ -563,9 +1147,17 @@ class PDFSignerGUI:
                                highlightthickness=0)
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.canvas.elements = []
-
-        self.h_scroll.config(command=self.canvas.xview)
-        self.v_scroll.config(command=self.canvas.yview)
+        # Arrastres y redimensionados se aplican como mucho una vez por fotograma
+        self.canvas.motion_scheduler = MotionScheduler(self.canvas, self.motion_fps)
+        self.canvas.selection_overlay = SelectionOverlay(self.canvas, self.remove_element)
+        self.canvas.spatial_index = SpatialGrid()
+        self.canvas.asset_store = self.asset_store
+        # Transformación de vista común: punto de la página -> píxel del canvas
+        self.canvas.view_zoom = self.zoom_level
+
+        self.h_scroll.config(command=self.on_xscroll)
+        self.v_scroll.config(command=self.on_yscroll)
+        self.canvas.bind('<Configure>', lambda e: self.schedule_view_update())
         
         # Soporte para scroll con rueda del ratón
         self.canvas.bind('<MouseWheel>', self.on_mousewheel)
@@ -583,14 +1175,134 @@ class PDFSignerGUI:
         
         ttk.Button(nav_frame, text="Siguiente ➡", command=self.next_page, width=12).pack(side=tk.RIGHT, padx=2)
         ttk.Button(nav_frame, text="Última ⏭", command=self.last_page, width=12).pack(side=tk.RIGHT, padx=2)
+        self.continuous_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(nav_frame, text="Desplazamiento continuo", variable=self.continuous_var,
+                        command=self.toggle_continuous).pack(side=tk.RIGHT, padx=10)
 
+        # Clic, arrastre y doble clic se resuelven con el índice espacial de la página
         self.canvas.bind('<Button-1>', self.on_canvas_click)
+        self.canvas.bind('<B1-Motion>', self.on_canvas_drag)
+        self.canvas.bind('<ButtonRelease-1>', self.on_canvas_release)
+        self.canvas.bind('<Double-Button-1>', self.on_canvas_double_click)
+
+    def page_point(self, event):
+        """Convierte un evento del canvas a puntos de la página mostrada"""
+        return self.canvas_to_page(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+
+    def canvas_to_page(self, x, y):
+        x0, y0 = self.page_origin(self.current_page)
+        return (x - x0) / self.zoom_level, (y - y0) / self.zoom_level
+
+    def page_origin(self, index):
+        """Esquina superior izquierda de una página en coordenadas del canvas"""
+        if self.continuous:
+            return self.shadow_offset, self.page_tops[index]
+        return self.shadow_offset, self.shadow_offset
+
+    def page_at(self, y):
+        """Página del modo continuo que ocupa la coordenada y del canvas"""
+        index = bisect.bisect_right(self.page_tops, y) - 1
+        return min(max(index, 0), self.total_pages - 1)
 
     def on_canvas_click(self, event):
         hit = self.canvas.find_withtag("current")
-        if not hit or not any(tag in self.canvas.gettags(hit[0]) for tag in ['element']):
-            for elem in self.canvas.elements:
-                elem.deselect()
+        if hit and 'overlay' in self.canvas.gettags(hit[0]):
+            # Manejadores y botón X tienen sus propios bindings
+            return
+        overlay = self.canvas.selection_overlay
+        self.pressed_element = None
+        if self.continuous and self.page_tops:
+            # Los clics se resuelven en la página bajo el puntero
+            index = self.page_at(self.canvas.canvasy(event.y))
+            if index != self.current_page:
+                overlay.detach()
+                self.set_current_page(index)
+        px, py = self.page_point(event)
+        elem = self.canvas.spatial_index.query_point(px, py)
+        if elem is None:
+            # Empezar selección por rectángulo
+            overlay.detach()
+            x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+            self.rubber_band = (x, y)
+            self.canvas.create_rectangle(x, y, x, y, outline='#0078d7', dash=(3, 3), tags=('rubber_band',))
+            return
+        if event.state & 0x0005:
+            # Shift/Ctrl: añadir o quitar de la selección
+            selection = overlay.selection()
+            if elem in selection:
+                selection.remove(elem)
+            else:
+                selection.append(elem)
+            overlay.set_group(selection)
+            return
+        if elem in overlay.group:
+            # Mover el grupo completo
+            self.group_drag = (event.x, event.y, [(e, e.x, e.y) for e in overlay.group])
+            return
+        self.pressed_element = elem
+        elem.on_press(event)
+
+    def on_canvas_drag(self, event):
+        if self.rubber_band:
+            x0, y0 = self.rubber_band
+            self.canvas.coords('rubber_band', x0, y0, self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        elif self.group_drag:
+            self.canvas.motion_scheduler.post(self.apply_group_drag, event.x, event.y)
+        elif self.pressed_element:
+            self.pressed_element.on_drag(event)
+
+    def apply_group_drag(self, x, y):
+        if not self.group_drag:
+            return
+        x0, y0, starts = self.group_drag
+        dx = (x - x0) / self.zoom_level
+        dy = (y - y0) / self.zoom_level
+        for elem, ex, ey in starts:
+            elem.x = ex + dx
+            elem.y = ey + dy
+            elem.update_visual()
+        self.canvas.selection_overlay.place_group()
+
+    def on_canvas_release(self, event):
+        if self.rubber_band:
+            x0, y0 = self.rubber_band
+            self.rubber_band = None
+            self.canvas.delete('rubber_band')
+            x1, y1 = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+            found = self.canvas.spatial_index.query_rect(*self.canvas_to_page(x0, y0),
+                                                         *self.canvas_to_page(x1, y1))
+            self.canvas.selection_overlay.set_group(found)
+        elif self.group_drag:
+            self.canvas.motion_scheduler.flush()
+            self.group_drag = None
+        elif self.pressed_element:
+            self.pressed_element.on_release(event)
+            self.pressed_element = None
+
+    def on_canvas_double_click(self, event):
+        elem = self.canvas.spatial_index.query_point(*self.page_point(event))
+        if elem is not None:
+            elem.start_edit(event)
+
+    def page_index(self, page_num):
+        index = self.page_indexes.get(page_num)
+        if index is None:
+            index = self.page_indexes[page_num] = SpatialGrid()
+        return index
+
+    def register_element(self, elem):
+        elem.page_num = self.current_page
+        # El elemento se creó sin desplazamiento: colocarlo sobre su página
+        elem.display_offset_x, elem.display_offset_y = self.page_origin(self.current_page)
+        elem.update_visual()
+        self.elements.append(elem)
+        self.session.add(elem.model)
+        self.canvas.elements.append(elem)
+        self.canvas.spatial_index.insert(elem, elem.page_bbox())
+        self.update_thumbnail_marks()
+
+    def update_thumbnail_marks(self):
+        self.thumbnails.set_marked(self.session.pages_with_elements())
     
     def on_mousewheel(self, event):
         """Soporte para scroll con rueda del ratón"""
@@ -598,64 +1310,574 @@ class PDFSignerGUI:
             self.canvas.yview_scroll(1, "units")
         elif event.num == 4 or event.delta > 0:
             self.canvas.yview_scroll(-1, "units")
+        self.schedule_view_update()
+
+    def on_xscroll(self, *args):
+        self.canvas.xview(*args)
+        self.schedule_view_update()
+
+    def on_yscroll(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_view_update()
 
     def load_pdf(self):
+        if self.export_job is not None:
+            messagebox.showwarning("Advertencia", "Espera a que termine el guardado en curso")
+            return
         path = filedialog.askopenfilename(filetypes=[("PDF", "*.pdf")])
         if path:
             try:
+                # MuPDF no admite dos hilos a la vez ni sobre documentos distintos.
+                # Un solo análisis del archivo para ver y para exportar; si falla,
+                # el documento anterior sigue abierto y la ventana intacta
+                with self.render_worker.lock:
+                    session = SignDocument(path, self.asset_store, self.exporter)
+                # Los workers pueden seguir renderizando el documento anterior
+                self.render_worker.cancel()
+                self.thumbnails.worker.cancel()
+                with self.render_worker.lock:
+                    if self.session is not None:
+                        # Suelta las imágenes de los elementos del documento anterior
+                        self.session.close()
+                    self.session = session
+                    # Tamaños en puntos para dibujar la página antes de rasterizarla
+                    self.page_sizes = self.session.page_sizes
+                    self.total_pages = len(self.session)
                 self.pdf_path = path
-                self.pdf_document = fitz.open(path)
-                self.total_pages = len(self.pdf_document)
+                self.document = self.session.pdf
+                self.pdf_document = self.document.doc
+                self.doc_key = self.document.key
                 self.current_page = 0
                 self.elements = []
+                self.page_indexes = {}
                 self.zoom_level = 1.0
+                content_hash = self.document.content_hash if self.disk_cache else None
+                self.thumbnails.load(self.pdf_document, self.doc_key, self.page_sizes, content_hash)
                 self.render_page()
                 messagebox.showinfo("Éxito", f"PDF cargado correctamente\n{self.total_pages} páginas")
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo cargar el PDF:\n{str(e)}")
 
     def render_page(self):
+        self.canvas.view_zoom = self.zoom_level
         self.canvas.delete("all")
+        self.canvas.selection_overlay.create_items()
+        self.rubber_band = None
+        self.group_drag = None
+        self.pressed_element = None
         if not self.pdf_document:
             return
         
-        page = self.pdf_document[self.current_page]
-        mat = fitz.Matrix(self.zoom_level, self.zoom_level)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        
-        # Convertir a imagen con mejor calidad
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        
-        # Crear fondo gris para simular sombra del documento
-        self.shadow_offset = 10
-        bg_width = pix.width + self.shadow_offset * 2
-        bg_height = pix.height + self.shadow_offset * 2
-        background = Image.new('RGB', (bg_width, bg_height), '#2b2b2b')
-        
-        # Crear sombra
-        shadow = Image.new('RGBA', (pix.width + 10, pix.height + 10), (0, 0, 0, 80))
-        background.paste(shadow, (self.shadow_offset + 5, self.shadow_offset + 5))
-        
-        # Pegar PDF sobre el fondo
-        background.paste(img, (self.shadow_offset, self.shadow_offset))
-        
-        self.pdf_img = ImageTk.PhotoImage(background)
-        self.canvas.create_image(self.shadow_offset, self.shadow_offset, image=self.pdf_img, anchor='nw', tags='pdf_bg')
-        
-        # Configurar región de scroll para mostrar todo el contenido
-        self.canvas.config(scrollregion=(0, 0, bg_width, bg_height))
-        
-        # Actualizar etiquetas
-        self.page_label.config(text=f"Página {self.current_page + 1} de {self.total_pages}")
-        self.zoom_label.config(text=f"{int(self.zoom_level * 100)}%")
+        # Trabajos de la página anterior ya no interesan
+        self.render_worker.cancel()
+        if self.prefetch_after_id:
+            self.root.after_cancel(self.prefetch_after_id)
+            self.prefetch_after_id = None
+        self.drawn_tiles = {}
+        self.drawn_pages = {}
+        self.page_previews = {}
+        self.canvas.elements = []
+        self.canvas.spatial_index = self.page_index(self.current_page)
+
+        if self.continuous:
+            # Todas las páginas en una sola región; solo se dibujan las visibles
+            self.visible_key = None
+            self.layout_pages()
+            self.canvas.yview_moveto((self.page_tops[self.current_page] - self.shadow_offset) / self.scroll_height)
+            self.update_visible_pages()
+            self.update_page_labels()
+            return
+
+        self.draw_page_background()
+        self.update_page_labels()
 
         # Re-crear elementos visuales de la página actual
-        self.canvas.elements = [e for e in self.elements if getattr(e, 'page_num', -1) == self.current_page]
+        self.draw_page_elements(self.current_page)
+
+    def draw_page_background(self):
+        """Marco, vista previa y mapa de bits (o teselas) de la página visible"""
+        key = self.page_key(self.current_page)
+        self.visible_key = key
+
+        # Sombra y fondo blanco como items del canvas: cuestan lo mismo a cualquier zoom
+        self.draw_page_frame()
+        if self.tiled_mode():
+            # A zoom alto solo se rasterizan las teselas visibles; nunca se crea
+            # un mapa de bits de la página entera a este tamaño
+            self.preview_tiles = {}
+            if not self.has_tile_preview():
+                width, _, _, _ = self.page_grid()
+                self.canvas.create_text(self.shadow_offset + width // 2, self.shadow_offset + 30,
+                                        text="Cargando...", fill='#888888', font=('Arial', 12),
+                                        tags=('pdf_bg', 'placeholder'))
+                # Con el zoom asentado la pide update_visible_tiles, solo si
+                # alguna tesela visible no está en caché
+                if self.zoom_settling():
+                    self.request_preview()
+            self.schedule_view_update()
+        else:
+            photo = self.page_cache.get(key)
+            if photo is None and not self.zoom_settling():
+                photo = self.disk_photo(key, self.page_cache, render_page_bitmap,
+                                        (self.pdf_document, self.current_page, self.zoom_level))
+            if photo is not None:
+                self.show_page_bitmap(photo)
+            else:
+                self.show_preview()
+                if not self.zoom_settling():
+                    self.submit_render(key, render_page_bitmap,
+                                       (self.pdf_document, self.current_page, self.zoom_level),
+                                       RenderWorker.PRIORITY_VISIBLE)
+
+    def rescale_view(self):
+        """Aplica un cambio de zoom sin recrear los elementos.
+
+        Solo se redibuja el fondo de la página; los items de los elementos se
+        recolocan con la nueva transformación y únicamente las imágenes se
+        remuestrean (rápido mientras siguen llegando clics de zoom).
+        """
+        if not self.pdf_document:
+            return
+        if self.continuous:
+            # Cambia la posición de todas las páginas: se vuelve a maquetar
+            self.render_page()
+            return
+        self.canvas.view_zoom = self.zoom_level
+        self.render_worker.cancel()
+        if self.prefetch_after_id:
+            self.root.after_cancel(self.prefetch_after_id)
+            self.prefetch_after_id = None
+        self.drawn_tiles = {}
+        self.canvas.delete('pdf_bg')
+        self.draw_page_background()
+        self.canvas.tag_lower('pdf_bg')
+        self.update_page_labels()
+
+        fast = self.zoom_settling()
         for elem in self.canvas.elements:
-            # Temporalmente ajustar posición para visualización
-            elem.display_offset_x = self.shadow_offset
-            elem.display_offset_y = self.shadow_offset
+            elem.update_visual(fast)
+        overlay = self.canvas.selection_overlay
+        if overlay.group:
+            overlay.place_group()
+        elif overlay.element is not None:
+            overlay.place()
+
+    def update_page_labels(self):
+        self.page_label.config(text=f"Página {self.current_page + 1} de {self.total_pages}")
+        self.zoom_label.config(text=f"{int(self.zoom_level * 100)}%")
+        self.thumbnails.set_current(self.current_page)
+
+    def draw_page_elements(self, index):
+        x0, y0 = self.page_origin(index)
+        for elem in self.elements:
+            if getattr(elem, 'page_num', -1) != index:
+                continue
+            # Posición de pantalla = posición en la página + origen de la página
+            elem.display_offset_x = x0
+            elem.display_offset_y = y0
             elem.create_visual()
+            self.canvas.elements.append(elem)
+
+    def set_current_page(self, index):
+        """Cambia la página activa sin redibujar (modo continuo)"""
+        self.current_page = index
+        self.canvas.spatial_index = self.page_index(index)
+        self.update_page_labels()
+
+    def toggle_continuous(self):
+        self.continuous = self.continuous_var.get()
+        if self.pdf_document:
+            self.render_page()
+
+    def layout_pages(self):
+        """Posición vertical de cada página en el modo continuo, al zoom actual"""
+        self.page_tops = []
+        y = self.shadow_offset
+        width = 0
+        for pw, ph in self.page_sizes:
+            self.page_tops.append(y)
+            y += int(ph * self.zoom_level) + PAGE_GAP
+            width = max(width, int(pw * self.zoom_level))
+        self.scroll_height = y + self.shadow_offset
+        self.canvas.config(scrollregion=(0, 0, width + self.shadow_offset * 2, self.scroll_height))
+
+    def update_visible_pages(self):
+        """Dibuja las páginas que cortan la vista (más un margen) y suelta las demás"""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = self.page_at(top)
+        last = self.page_at(bottom)
+        keep = range(max(0, first - CONTINUOUS_MARGIN_PAGES),
+                     min(self.total_pages - 1, last + CONTINUOUS_MARGIN_PAGES) + 1)
+
+        for index in list(self.drawn_pages):
+            if index not in keep:
+                self.release_page(index)
+
+        # Los trabajos de páginas que salieron de la vista se descartan
+        self.render_worker.cancel()
+        for index in keep:
+            if index not in self.drawn_pages:
+                self.draw_continuous_page(index)
+            if self.drawn_pages[index] is None:
+                key = self.page_key(index)
+                photo = self.page_cache.get(key)
+                if photo is not None:
+                    self.show_page_at(index, photo)
+                elif not self.zoom_settling():
+                    priority = RenderWorker.PRIORITY_VISIBLE if first <= index <= last \
+                        else RenderWorker.PRIORITY_PREFETCH
+                    self.submit_render(key, render_page_bitmap,
+                                       (self.pdf_document, index, self.zoom_level), priority)
+        self.canvas.selection_overlay.raise_items()
+
+        # La página activa sigue al centro de la vista, salvo mientras haya
+        # algo seleccionado o arrastrándose en ella
+        center = self.page_at((top + bottom) / 2)
+        busy = self.pressed_element or self.group_drag or self.rubber_band
+        if center != self.current_page and not busy and not self.canvas.selection_overlay.selection():
+            self.set_current_page(center)
+
+    def draw_continuous_page(self, index):
+        x0, y0 = self.page_origin(index)
+        pw, ph = self.page_sizes[index]
+        width, height = int(pw * self.zoom_level), int(ph * self.zoom_level)
+        tag = f'page{index}'
+        self.canvas.create_rectangle(x0 + 5, y0 + 5, x0 + width + 10, y0 + height + 10,
+                                     fill='#1a1a1a', outline='', tags=('pdf_bg', 'page_frame', tag))
+        self.canvas.create_rectangle(x0, y0, x0 + width, y0 + height,
+                                     fill='white', outline='', tags=('pdf_bg', 'page_frame', tag))
+        preview = self.preview_photo(index)
+        if preview is not None:
+            item = self.canvas.create_image(x0, y0, image=preview, anchor='nw',
+                                            tags=('pdf_bg', tag, f'preview{index}'))
+            self.page_previews[index] = preview
+        else:
+            self.canvas.create_text(x0 + width // 2, y0 + 30, text="Cargando...", fill='#888888',
+                                    font=('Arial', 12), tags=('pdf_bg', tag, f'placeholder{index}'))
+        self.drawn_pages[index] = None
+        self.draw_page_elements(index)
+
+    def show_page_at(self, index, photo):
+        self.canvas.delete(f'placeholder{index}')
+        self.canvas.delete(f'preview{index}')
+        self.page_previews.pop(index, None)
+        x0, y0 = self.page_origin(index)
+        item = self.canvas.create_image(x0, y0, image=photo, anchor='nw',
+                                        tags=('pdf_bg', 'page_bitmap', f'page{index}'))
+        # Debajo de cualquier elemento
+        self.canvas.tag_lower(item)
+        self.canvas.tag_lower('page_frame')
+        self.drawn_pages[index] = photo
+
+    def release_page(self, index):
+        """Borra del canvas una página que salió de la vista junto con sus elementos"""
+        overlay = self.canvas.selection_overlay
+        if any(e.page_num == index for e in overlay.selection()):
+            overlay.detach()
+        self.canvas.delete(f'page{index}')
+        self.page_previews.pop(index, None)
+        for elem in [e for e in self.canvas.elements if e.page_num == index]:
+            self.canvas.delete(elem.canvas_id)
+            # La imagen remuestreada se vuelve a generar al volver a la página
+            elem.photo = None
+            self.canvas.elements.remove(elem)
+        del self.drawn_pages[index]
+
+    def submit_render(self, key, func, args, priority):
+        content_hash = self.document.content_hash if self.disk_cache else None
+        func, args = disk_render_job(self.disk_cache, content_hash, func, args)
+        self.render_worker.submit(key, func, args, priority)
+
+    def disk_photo(self, key, cache, func, args):
+        """Mapa de bits nítido de la caché en disco, leído sin pasar por el worker.
+
+        Si ya está en disco se muestra enseguida, sin vista previa ni cola;
+        devuelve None si no lo está (o no hay caché en disco).
+        """
+        if self.disk_cache is None:
+            return None
+        bitmap = self.disk_cache.get(disk_render_key(self.document.content_hash, func, args))
+        if bitmap is None:
+            return None
+        ppm, width, height = bitmap
+        photo = tk.PhotoImage(master=self.root, data=ppm, format='PPM')
+        cache.put(key, photo, width * height * 4)
+        return photo
+
+    def page_key(self, page_index):
+        return (self.doc_key, page_index, round(self.zoom_level, 3))
+
+    def draw_page_frame(self):
+        """Dibuja sombra y fondo de la página; el mapa de bits va encima"""
+        width, height, _, _ = self.page_grid()
+        origin = self.shadow_offset
+        self.canvas.create_rectangle(origin + 5, origin + 5, origin + width + 10, origin + height + 10,
+                                     fill='#1a1a1a', outline='', tags=('pdf_bg', 'page_frame'))
+        self.canvas.create_rectangle(origin, origin, origin + width, origin + height,
+                                     fill='white', outline='', tags=('pdf_bg', 'page_frame'))
+        self.canvas.config(scrollregion=(0, 0, width + origin * 2, height + origin * 2))
+
+    def zoom_settling(self):
+        """True mientras llegan clics de zoom seguidos: solo se muestran vistas previas"""
+        return self.zoom_after_id is not None
+
+    def schedule_zoom(self):
+        """Redibuja enseguida con vista previa y agrupa los clics de zoom seguidos
+        en un único renderizado nítido"""
+        if self.zoom_after_id:
+            self.root.after_cancel(self.zoom_after_id)
+        self.zoom_after_id = self.root.after(ZOOM_SETTLE_MS, self.finish_zoom)
+        self.rescale_view()
+
+    def finish_zoom(self):
+        self.zoom_after_id = None
+        self.rescale_view()
+
+    def enlarge_preview(self, small, index):
+        """Amplía una vista previa reducida a la medida exacta de la página.
+
+        La ampliación por un factor entero la hace Tk sin pasar por Python;
+        el destino tiene tamaño fijo, así que lo que sobre se recorta.
+        """
+        pw, ph = self.page_sizes[index]
+        photo = tk.PhotoImage(master=self.root, width=max(1, int(pw * self.zoom_level)),
+                              height=max(1, int(ph * self.zoom_level)))
+        photo.tk.call(photo, 'copy', small, '-zoom', PREVIEW_FACTOR, PREVIEW_FACTOR)
+        return photo
+
+    def preview_photo(self, index):
+        """Copia escalada al zoom actual del mapa de bits en caché más cercano de la página"""
+        best = None
+        for key, (photo, _) in self.page_cache.entries.items():
+            if key[0] != self.doc_key or key[1] != index or key[2] == round(self.zoom_level, 3):
+                continue
+            # A igual distancia, mejor reducir que ampliar
+            distance = abs(key[2] - self.zoom_level) - (0.01 if key[2] > self.zoom_level else 0)
+            if best is None or distance < best[0]:
+                best = (distance, photo)
+        if best is None:
+            return None
+        pw, ph = self.page_sizes[index]
+        size = (max(1, -(-int(pw * self.zoom_level) // PREVIEW_FACTOR)),
+                max(1, -(-int(ph * self.zoom_level) // PREVIEW_FACTOR)))
+        img = ImageTk.getimage(best[1]).resize(size, Image.BILINEAR)
+        ppm, _, _ = image_to_ppm(img)
+        return self.enlarge_preview(tk.PhotoImage(master=self.root, data=ppm, format='PPM'), index)
+
+    def show_preview(self):
+        """Muestra al instante una vista previa de la página visible.
+
+        Si hay en caché la misma página a otro zoom se escala; si no, se pide
+        un renderizado de baja resolución antes que el nítido.
+        """
+        photo = self.preview_photo(self.current_page)
+        if photo is not None:
+            self.show_preview_bitmap(photo)
+            return
+        width, _, _, _ = self.page_grid()
+        self.canvas.create_text(self.shadow_offset + width // 2, self.shadow_offset + 30,
+                                text="Cargando...", fill='#888888', font=('Arial', 12),
+                                tags=('pdf_bg', 'placeholder'))
+        self.request_preview()
+
+    def request_preview(self):
+        # A menor resolución cuesta una fracción del nítido; no pasa por la
+        # caché en disco porque es desechable
+        zoom = self.zoom_level / PREVIEW_FACTOR
+        if self.tiled_mode():
+            pw, ph = self.page_sizes[self.current_page]
+            zoom = min(zoom, math.sqrt(TILE_PREVIEW_PIXELS / (pw * ph)))
+        self.render_worker.submit(('preview',) + self.visible_key, render_page_bitmap,
+                                  (self.pdf_document, self.current_page, zoom),
+                                  RenderWorker.PRIORITY_VISIBLE)
+
+    def has_tile_preview(self):
+        # Sirve la de cualquier zoom: solo se ve hasta que llegan las teselas nítidas
+        return self.tile_preview is not None and self.tile_preview[0] == (self.doc_key, self.current_page)
+
+    def show_tile_preview(self, col, row):
+        """Tesela provisional: su trozo de la vista previa ampliado a su tamaño"""
+        width, height, _, _ = self.page_grid()
+        source = self.tile_preview[1]
+        scale = source.width / width
+        x0, y0 = col * TILE_SIZE, row * TILE_SIZE
+        x1, y1 = min(width, x0 + TILE_SIZE), min(height, y0 + TILE_SIZE)
+        region = source.crop((int(x0 * scale), int(y0 * scale),
+                              max(int(x0 * scale) + 1, math.ceil(x1 * scale)),
+                              max(int(y0 * scale) + 1, math.ceil(y1 * scale))))
+        ppm, _, _ = image_to_ppm(region.resize((x1 - x0, y1 - y0), Image.BILINEAR))
+        photo = tk.PhotoImage(master=self.root, data=ppm, format='PPM')
+        origin = self.shadow_offset
+        item = self.canvas.create_image(origin + x0, origin + y0, image=photo, anchor='nw',
+                                        tags=('pdf_bg', 'tile_preview'))
+        self.canvas.tag_raise(item, 'page_frame')
+        self.preview_tiles[(col, row)] = (item, photo)
+
+    def show_preview_bitmap(self, photo):
+        self.canvas.delete('placeholder')
+        self.preview_img = photo
+        item = self.canvas.create_image(self.shadow_offset, self.shadow_offset, image=photo,
+                                        anchor='nw', tags=('pdf_bg', 'preview'))
+        self.canvas.tag_raise(item, 'page_frame')
+
+    def show_page_bitmap(self, photo):
+        """Coloca el mapa de bits de la página visible bajo los elementos"""
+        self.canvas.delete('placeholder')
+        self.canvas.delete('preview')
+        self.preview_img = None
+        self.pdf_img = photo
+        item = self.canvas.create_image(self.shadow_offset, self.shadow_offset, image=self.pdf_img,
+                                        anchor='nw', tags=('pdf_bg', 'page_bitmap'))
+        self.canvas.tag_raise(item, 'page_frame')
+
+        # Con la página visible lista, precargar las vecinas cuando haya calma
+        if self.prefetch_after_id:
+            self.root.after_cancel(self.prefetch_after_id)
+        self.prefetch_after_id = self.root.after(PREFETCH_DELAY_MS, self.prefetch_neighbours)
+
+    def prefetch_neighbours(self):
+        self.prefetch_after_id = None
+        if not self.pdf_document:
+            return
+        for index in (self.current_page + 1, self.current_page - 1):
+            if 0 <= index < self.total_pages:
+                key = self.page_key(index)
+                if key not in self.page_cache:
+                    self.submit_render(key, render_page_bitmap,
+                                       (self.pdf_document, index, self.zoom_level),
+                                       RenderWorker.PRIORITY_PREFETCH)
+
+    def tiled_mode(self):
+        return not self.continuous and round(self.zoom_level, 3) >= TILE_ZOOM_THRESHOLD
+
+    def page_grid(self):
+        """Tamaño en píxeles de la página visible y número de columnas/filas de teselas"""
+        pw, ph = self.page_sizes[self.current_page]
+        width = int(pw * self.zoom_level)
+        height = int(ph * self.zoom_level)
+        cols = (width + TILE_SIZE - 1) // TILE_SIZE
+        rows = (height + TILE_SIZE - 1) // TILE_SIZE
+        return width, height, cols, rows
+
+    def schedule_view_update(self):
+        # Agrupar ráfagas de eventos de scroll en una sola actualización
+        if self.view_after_id is None and self.pdf_document and (self.continuous or self.tiled_mode()):
+            self.view_after_id = self.root.after_idle(self.update_view)
+
+    def update_view(self):
+        self.view_after_id = None
+        if not self.pdf_document:
+            return
+        if self.continuous:
+            self.update_visible_pages()
+        elif self.tiled_mode():
+            # Mientras llegan clics de zoom solo se muestran teselas provisionales
+            self.update_visible_tiles(render=not self.zoom_settling())
+
+    def update_visible_tiles(self, render=True):
+        """Muestra las teselas que cortan la zona visible y pide las que faltan"""
+        _, _, cols, rows = self.page_grid()
+        origin = self.shadow_offset
+        left = self.canvas.canvasx(0) - origin
+        top = self.canvas.canvasy(0) - origin
+        right = left + self.canvas.winfo_width()
+        bottom = top + self.canvas.winfo_height()
+        c0, c1 = max(0, int(left // TILE_SIZE)), min(cols - 1, int(right // TILE_SIZE))
+        r0, r1 = max(0, int(top // TILE_SIZE)), min(rows - 1, int(bottom // TILE_SIZE))
+        visible = {(c, r) for c in range(c0, c1 + 1) for r in range(r0, r1 + 1)}
+
+        # Liberar del canvas las teselas que ya no se ven (siguen en la caché)
+        for tiles in (self.drawn_tiles, self.preview_tiles):
+            for cell in list(tiles):
+                if cell not in visible:
+                    self.canvas.delete(tiles.pop(cell)[0])
+
+        if render:
+            # Los trabajos de teselas que salieron de la vista se descartan
+            self.render_worker.cancel()
+        missing = []
+        for col, row in sorted(visible, key=lambda cell: (cell[1], cell[0])):
+            if (col, row) in self.drawn_tiles:
+                continue
+            key = self.tile_key(col, row)
+            args = (self.pdf_document, self.current_page, self.zoom_level, col, row)
+            photo = self.tile_cache.get(key)
+            if photo is None and render:
+                photo = self.disk_photo(key, self.tile_cache, render_tile_bitmap, args)
+            if photo is not None:
+                self.show_tile(col, row, photo)
+                continue
+            if (col, row) not in self.preview_tiles and self.has_tile_preview():
+                self.show_tile_preview(col, row)
+            missing.append((key, args))
+        if render and missing:
+            if not self.has_tile_preview():
+                # La vista previa aún no había llegado y quedan teselas por rasterizar
+                self.request_preview()
+            for key, args in missing:
+                self.submit_render(key, render_tile_bitmap, args, RenderWorker.PRIORITY_VISIBLE)
+
+    def tile_key(self, col, row):
+        return ('tile',) + self.page_key(self.current_page) + (col, row)
+
+    def show_tile(self, col, row, photo):
+        if (col, row) in self.preview_tiles:
+            self.canvas.delete(self.preview_tiles.pop((col, row))[0])
+        origin = self.shadow_offset
+        item = self.canvas.create_image(origin + col * TILE_SIZE, origin + row * TILE_SIZE,
+                                        image=photo, anchor='nw', tags=('pdf_bg', 'tile'))
+        # Encima del fondo y de la vista previa pero debajo de los elementos
+        self.canvas.tag_raise(item, 'pdf_bg')
+        self.drawn_tiles[(col, row)] = (item, photo)
+
+    def poll_render_results(self):
+        """Recoge en el hilo de Tk los mapas de bits terminados por el worker"""
+        for key, bitmap, error in self.render_worker.drain():
+            if error is not None:
+                print(f"Error al renderizar {key}: {error}")
+                continue
+            # Tk decodifica el PPM directamente; solo puede hacerse en el hilo principal
+            ppm, width, height = bitmap
+            photo = tk.PhotoImage(master=self.root, data=ppm, format='PPM')
+            # Tk guarda las fotos a 4 bytes por píxel
+            nbytes = width * height * 4
+            if key[0] == 'preview':
+                if key[1:] != self.visible_key:
+                    continue
+                if self.tiled_mode():
+                    # Se guarda pequeña; cada tesela visible recorta su parte
+                    self.tile_preview = (key[1:3], ImageTk.getimage(photo))
+                    self.canvas.delete('placeholder')
+                    self.schedule_view_update()
+                # Solo si aún no llegó la versión nítida
+                elif not self.canvas.find_withtag('page_bitmap'):
+                    self.show_preview_bitmap(self.enlarge_preview(photo, key[2]))
+                continue
+            if key[0] == 'tile':
+                self.tile_cache.put(key, photo, nbytes)
+                col, row = key[-2:]
+                if key == self.tile_key(col, row) and (col, row) not in self.drawn_tiles:
+                    self.show_tile(col, row, photo)
+                continue
+            self.page_cache.put(key, photo, nbytes)
+            if key == self.visible_key:
+                self.show_page_bitmap(photo)
+            elif self.continuous:
+                index = key[1]
+                if self.drawn_pages.get(index, False) is None and key == self.page_key(index):
+                    self.show_page_at(index, photo)
+        self.thumbnails.poll()
+        self.root.after(RENDER_POLL_MS, self.poll_render_results)
+
+    def on_close(self):
+        if self.export_job is not None:
+            # Cancelar y esperar a que el hilo borre su temporal
+            self.export_job.progress.cancel()
+            self.export_job.thread.join(5)
+        self.render_worker.shutdown()
+        self.thumbnails.shutdown()
+        self.root.destroy()
 
     def add_text_element(self):
         if not self.pdf_document:
@@ -690,9 +1912,7 @@ class PDFSignerGUI:
                                       font_size=font_size,
                                       font_family=self.font_family_var.get(),
                                       color=self.current_color)
-                elem.page_num = self.current_page
-                self.elements.append(elem)
-                self.canvas.elements.append(elem)
+                self.register_element(elem)
                 dialog.destroy()
             else:
                 messagebox.showwarning("Advertencia", "El texto no puede estar vacío")
@@ -725,11 +1945,9 @@ class PDFSignerGUI:
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo cargar la imagen:\n{str(e)}")
 
-    def add_signature_from_image(self, img):
-        elem = DraggableElement(self.canvas, 100, 100, 'signature', img, width=200, height=80)
-        elem.page_num = self.current_page
-        self.elements.append(elem)
-        self.canvas.elements.append(elem)
+    def add_signature_from_image(self, img, vector=None):
+        elem = DraggableElement(self.canvas, 100, 100, 'signature', img, width=200, height=80, vector=vector)
+        self.register_element(elem)
         elem.select()
         messagebox.showinfo("Firma agregada", 
                           "Usa los círculos blancos para redimensionar la firma.\n" +
@@ -746,9 +1964,7 @@ class PDFSignerGUI:
         if path:
             try:
                 elem = DraggableElement(self.canvas, 100, 100, 'image', path, width=150, height=150)
-                elem.page_num = self.current_page
-                self.elements.append(elem)
-                self.canvas.elements.append(elem)
+                self.register_element(elem)
                 elem.select()
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo cargar la imagen:\n{str(e)}")
@@ -757,6 +1973,8 @@ class PDFSignerGUI:
         if not self.pdf_document:
             messagebox.showwarning("Advertencia", "Por favor carga un PDF primero")
             return
+        # tkcalendar solo se necesita aquí: no se importa al arrancar
+        from tkcalendar import Calendar
         
         dialog = tk.Toplevel(self.root)
         dialog.title("Agregar Fecha")
@@ -856,9 +2074,7 @@ class PDFSignerGUI:
                                       font_size=font_size,
                                       font_family=self.font_family_var.get(),
                                       color=self.current_color)
-                elem.page_num = self.current_page
-                self.elements.append(elem)
-                self.canvas.elements.append(elem)
+                self.register_element(elem)
                 elem.select()
                 dialog.destroy()
             except Exception as e:
@@ -899,27 +2115,34 @@ class PDFSignerGUI:
             elem.update_selection()
 
     def delete_selected(self):
-        to_remove = [e for e in self.elements if e.selected]
+        to_remove = self.canvas.selection_overlay.selection()
         if not to_remove:
             messagebox.showinfo("Info", "No hay elementos seleccionados para eliminar")
             return
         for e in to_remove:
-            e.delete()
-            self.elements.remove(e)
-            if e in self.canvas.elements:
-                self.canvas.elements.remove(e)
+            self.remove_element(e)
+
+    def remove_element(self, elem):
+        elem.delete()
+        self.page_index(elem.page_num).remove(elem)
+        if elem in self.elements:
+            self.elements.remove(elem)
+        self.session.remove(elem.model)
+        if elem in self.canvas.elements:
+            self.canvas.elements.remove(elem)
+        self.update_thumbnail_marks()
 
     def zoom_in(self): 
         self.zoom_level = min(3.0, self.zoom_level + 0.2)
-        self.render_page()
+        self.schedule_zoom()
         
     def zoom_out(self): 
         self.zoom_level = max(0.5, self.zoom_level - 0.2)
-        self.render_page()
+        self.schedule_zoom()
     
     def zoom_reset(self):
         self.zoom_level = 1.0
-        self.render_page()
+        self.schedule_zoom()
     
     def first_page(self):
         if not self.pdf_document:
@@ -949,11 +2172,21 @@ class PDFSignerGUI:
             self.current_page += 1
             self.render_page()
 
+    def go_to_page(self, index):
+        if not self.pdf_document:
+            return
+        if index != self.current_page and 0 <= index < self.total_pages:
+            self.current_page = index
+            self.render_page()
+
     def save_pdf(self):
         if not self.pdf_document:
             messagebox.showwarning("Advertencia", "No hay ningún PDF cargado")
             return
-        if not self.elements:
+        if self.export_job is not None:
+            messagebox.showwarning("Advertencia", "Ya hay un guardado en curso")
+            return
+        if not self.session.elements:
             result = messagebox.askyesno("Confirmar", 
                 "No hay elementos añadidos al PDF.\n¿Desea guardar el PDF original sin cambios?")
             if not result:
@@ -966,81 +2199,114 @@ class PDFSignerGUI:
         )
         if not path:
             return
-            
-        try:
-            reader = PdfReader(self.pdf_path)
-            writer = PdfWriter()
-            
-            for i in range(len(reader.pages)):
-                page = reader.pages[i]
-                pw = float(page.mediabox.width)
-                ph = float(page.mediabox.height)
-                
-                packet = io.BytesIO()
-                can = canvas.Canvas(packet, pagesize=(pw, ph))
-                
-                # Procesar elementos de esta página
-                page_elements = [e for e in self.elements if getattr(e, 'page_num', -1) == i]
-                
-                for elem in page_elements:
-                    # Usar las coordenadas reales del elemento (sin el offset de visualización)
-                    # Convertir coordenadas del canvas al sistema de coordenadas del PDF
-                    x = elem.x / self.zoom_level
-                    y = ph - (elem.y / self.zoom_level)
-                    
-                    if elem.element_type == 'text':
-                        # Mapear nombres de fuentes a los nombres válidos de ReportLab
-                        font_mapping = {
-                            'Arial': 'Helvetica',
-                            'Helvetica': 'Helvetica',
-                            'Times': 'Times-Roman',
-                            'Courier': 'Courier'
-                        }
-                        font_name = font_mapping.get(elem.font_family, 'Helvetica')
-                        
-                        try:
-                            can.setFont(font_name, elem.font_size / self.zoom_level)
-                            r, g, b = [int(elem.color[j:j+2], 16)/255 for j in (1, 3, 5)]
-                            can.setFillColorRGB(r, g, b)
-                            can.drawString(x, y, elem.content)
-                        except Exception as e:
-                            print(f"Error al agregar texto: {e}")
-                            # Usar fuente por defecto si falla
-                            can.setFont('Helvetica', 12)
-                            can.drawString(x, y, elem.content)
-                    else:
-                        try:
-                            if isinstance(elem.content, str):
-                                img = ImageReader(elem.content)
-                            else:
-                                buf = io.BytesIO()
-                                elem.content.save(buf, format='PNG')
-                                buf.seek(0)
-                                img = ImageReader(buf)
-                            w = elem.width / self.zoom_level
-                            h = elem.height / self.zoom_level
-                            can.drawImage(img, x, y - h, width=w, height=h, preserveAspectRatio=True)
-                        except Exception as e:
-                            print(f"Error al agregar imagen: {e}")
-                
-                can.save()
-                packet.seek(0)
-                overlay = PdfReader(packet)
-                if overlay.pages:
-                    page.merge_page(overlay.pages[0])
-                writer.add_page(page)
-            
-            with open(path, 'wb') as f:
-                writer.write(f)
-            
-            messagebox.showinfo("Éxito", f"PDF guardado correctamente en:\n{path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo guardar el PDF:\n{str(e)}")
 
+        # Solo hay un guardado a la vez: el exportador se configura antes de lanzarlo
+        self.exporter.image_dpi = EXPORT_IMAGE_DPI if self.downsample_var.get() else None
+        # El hilo de exportación trabaja sobre una copia: se puede seguir editando
+        snapshot = self.session.snapshot()
+        # Sus imágenes no se descartan aunque se borren los elementos mientras tanto
+        self.export_assets = [e.asset_id for page in snapshot.values() for e in page if e.asset_id]
+        for asset_id in self.export_assets:
+            self.asset_store.retain(asset_id)
+        self.export_job = ExportJob(self.exporter.export_pdf, self.document, path, snapshot,
+                                    self.incremental_var.get())
+        self.export_path = path
+        self.show_export_dialog()
+        self.root.after(EXPORT_POLL_MS, self.poll_export)
+
+    def show_export_dialog(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Guardando PDF")
+        dialog.geometry("380x140")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
+        dialog.protocol("WM_DELETE_WINDOW", self.cancel_export)
+
+        self.export_label = ttk.Label(dialog, text="Preparando...", font=('Arial', 10))
+        self.export_label.pack(pady=(15, 8))
+        self.export_bar = ttk.Progressbar(dialog, mode='determinate', length=320)
+        self.export_bar.pack(padx=25)
+        ttk.Button(dialog, text="✗ Cancelar", command=self.cancel_export, width=15).pack(pady=15)
+        self.export_dialog = dialog
+
+    def cancel_export(self):
+        if self.export_job is not None:
+            self.export_job.progress.cancel()
+            self.export_label.config(text="Cancelando...")
+
+    def poll_export(self):
+        job = self.export_job
+        if job is None:
+            return
+        progress = job.progress
+        if progress.total:
+            self.export_bar.config(maximum=progress.total, value=progress.done)
+            if not progress.cancelled:
+                self.export_label.config(text=f"Paso {progress.done} de {progress.total}")
+        if not job.finished():
+            self.root.after(EXPORT_POLL_MS, self.poll_export)
+            return
+
+        self.export_job = None
+        for asset_id in self.export_assets:
+            self.asset_store.release(asset_id)
+        self.export_assets = []
+        self.export_dialog.destroy()
+        if job.cancelled:
+            messagebox.showinfo("Cancelado", "Guardado cancelado. No se escribió ningún archivo.")
+        elif job.error is not None:
+            messagebox.showerror("Error", f"No se pudo guardar el PDF:\n{str(job.error)}")
+        else:
+            message = f"PDF guardado correctamente en:\n{self.export_path}"
+            original, written = progress.image_bytes()
+            if written < original:
+                mb = 1024 * 1024
+                message += f"\n\nImágenes: {original / mb:.1f} MB → {written / mb:.1f} MB"
+            if progress.errors:
+                message += "\n\nAlgunos elementos no se pudieron añadir:\n" + "\n".join(progress.errors)
+                messagebox.showwarning("Guardado incompleto", message)
+            else:
+                messagebox.showinfo("Éxito", message)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Firmador de PDF")
+    parser.add_argument('--batch', nargs=3, metavar=('PLANTILLA', 'ENTRADA', 'SALIDA'),
+                        help="firmar sin interfaz todos los PDF de ENTRADA con la plantilla JSON")
+    parser.add_argument('--workers', type=int, help="procesos del lote (por defecto, uno por núcleo)")
+    parser.add_argument('--report', help="informe JSON Lines (por defecto, en la carpeta de salida)")
+    parser.add_argument('--no-incremental', action='store_true',
+                        help="reescribir cada PDF completo en lugar de añadir una actualización")
+    parser.add_argument('--disk-cache', nargs='?', const=default_cache_dir(), metavar='CARPETA',
+                        help="guardar en disco las páginas renderizadas entre sesiones "
+                             "(por defecto, en la carpeta de caché del usuario)")
+    parser.add_argument('--disk-cache-mb', type=float, default=DISK_CACHE_MB,
+                        help="tamaño máximo de la caché en disco")
+    parser.add_argument('--max-memory-mb', type=float,
+                        help="memoria máxima que puede añadir cada proceso al reescribir un PDF")
+    parser.add_argument('--image-dpi', type=float, nargs='?', const=EXPORT_IMAGE_DPI, metavar='PPP',
+                        help=f"reducir las imágenes a esta resolución para su tamaño colocado "
+                             f"(por defecto, {EXPORT_IMAGE_DPI} ppp)")
+    parser.add_argument('--no-warm-up', action='store_true',
+                        help="no precargar en segundo plano las librerías de PDF al abrir la ventana")
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        layout_path, input_dir, output_dir = args.batch
+        try:
+            counts = run_batch(layout_path, input_dir, output_dir, workers=args.workers,
+                               report_path=args.report, incremental=not args.no_incremental,
+                               max_memory_mb=args.max_memory_mb, image_dpi=args.image_dpi)
+        except (OSError, ValueError) as e:
+            # Plantilla o imágenes no válidas: no se ha firmado nada
+            print(f"No se pudo empezar el lote: {e}", file=sys.stderr)
+            sys.exit(2)
+        print(f"Firmados: {counts['ok']}  Errores: {counts['error']}  Ya hechos: {counts['skipped']}")
+        sys.exit(1 if counts['error'] else 0)
 
-def main():
     root = tk.Tk()
-    app = PDFSignerGUI(root)
+    app = PDFSignerGUI(root, disk_cache_dir=args.disk_cache, disk_cache_mb=args.disk_cache_mb,
+                       warm_up=not args.no_warm_up)
     root.mainloop()
 
 
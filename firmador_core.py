@@ -0,0 +1,1751 @@
+"""
+Núcleo del firmador de PDF, sin interfaz gráfica.
+
+Documento abierto para firmar (SignDocument), modelo de elementos (Element)
+con la geometría en puntos de la página y exportación, además del
+renderizado de páginas, las cachés y el modo por lotes. No importa Tk:
+lo usan la interfaz de firmador.py, los procesos del lote y benchmark.py.
+
+  doc = SignDocument('entrada.pdf')
+  doc.add_text(0, 72, 72, "Firmado por: Nombre Apellido")
+  doc.add_image(0, 300, 700, 180, 72, 'firma.png', element_type='signature')
+  doc.export('salida.pdf')
+"""
+
+from PIL import Image
+import importlib
+import io
+import os
+import hashlib
+import math
+import gc
+import zlib
+import datetime
+import uuid
+import time
+import queue
+import itertools
+import threading
+import tempfile
+import shutil
+import sys
+import json
+import multiprocessing
+from collections import OrderedDict, namedtuple
+
+
+class LazyModule:
+    """Módulo que se importa la primera vez que se usa uno de sus nombres.
+
+    PyMuPDF, reportlab y PyPDF2 tardan en importarse más que el resto del
+    programa junto; así la ventana aparece sin esperarlos.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def load(self):
+        return importlib.import_module(self._name)
+
+    def __getattr__(self, attr):
+        value = getattr(self.load(), attr)
+        # Los siguientes accesos ya no pasan por aquí
+        setattr(self, attr, value)
+        return value
+
+
+fitz = LazyModule('fitz')
+canvas = LazyModule('reportlab.pdfgen.canvas')
+rl_utils = LazyModule('reportlab.lib.utils')
+PyPDF2 = LazyModule('PyPDF2')
+generic = LazyModule('PyPDF2.generic')
+ImageDraw = LazyModule('PIL.ImageDraw')
+
+
+# Presupuesto de memoria por defecto para la caché de páginas renderizadas (MB)
+PAGE_CACHE_MB = 256
+
+# Lado de cada tesela en píxeles de pantalla
+TILE_SIZE = 512
+
+# Lado mínimo del último nivel de la pirámide de reducciones de una imagen
+MIPMAP_MIN_SIZE = 64
+
+# Lado de las celdas del índice espacial de elementos, en puntos PDF: del
+# orden de un elemento típico (150 x 50), como lo era en píxeles a zoom 1
+GRID_CELL_SIZE = 128
+
+# Páginas que se procesan y vuelcan a disco de una vez al reescribir un PDF
+EXPORT_CHUNK_PAGES = 200
+
+# Lo que puede subir la memoria, como fracción de max_memory_mb, antes de
+# reducir la tanda de exportación (o de abortar con tandas de una página)
+EXPORT_MEMORY_SLACK = 0.1
+
+# Resolución a la que se reducen las imágenes al exportar, si se pide (ppp)
+EXPORT_IMAGE_DPI = 150
+
+# Calidad JPEG de las imágenes fotográficas reducidas al exportar
+EXPORT_JPEG_QUALITY = 85
+
+# Tope por defecto de la caché de renderizado en disco (MB)
+DISK_CACHE_MB = 512
+
+# Ancho del trazo de la firma dibujada y tolerancia al simplificarlo (píxeles)
+SIGNATURE_STROKE_WIDTH = 3
+SIGNATURE_TOLERANCE = 0.75
+
+# Grosor mínimo y máximo del trazo variable según la velocidad (píxeles)
+SIGNATURE_MIN_WIDTH = 1.5
+SIGNATURE_MAX_WIDTH = 4.5
+
+# Las firmas dibujadas se exportan como curvas de Bézier (False: segmentos rectos)
+SIGNATURE_VECTOR_CURVES = True
+
+# Estado de un elemento copiado para exportarlo en otro hilo o proceso
+ElementSnapshot = namedtuple('ElementSnapshot', [
+    'element_type', 'x', 'y', 'width', 'height', 'content',
+    'font_family', 'font_size', 'color', 'asset_id'])
+
+# Geometría de una firma dibujada: trazos (x, y, t) en píxeles de su imagen recortada
+VectorSignature = namedtuple('VectorSignature', ['width', 'height', 'strokes', 'variable_width'])
+
+
+class BitmapCache:
+    """Caché LRU de mapas de bits limitada por tamaño en bytes.
+
+    Cada entrada guarda su tamaño; al superar el presupuesto se expulsan
+    las entradas menos usadas recientemente.
+    """
+
+    def __init__(self, max_mb=PAGE_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            # No cabe ni vacía: no se guarda
+            return
+        self.entries[key] = (value, nbytes)
+        self.total_bytes += nbytes
+        self._trim()
+
+    def set_budget(self, max_mb):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._trim()
+
+    def _trim(self):
+        while self.entries and self.total_bytes > self.max_bytes:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def pixmap_to_ppm(pix):
+    """Devuelve (datos PPM, ancho, alto) de un pixmap RGB sin alfa.
+
+    La cabecera se une a una vista de memoria de las muestras, de modo que
+    los píxeles se copian una sola vez; Tk decodifica el PPM directamente,
+    sin pasar por PIL.
+    """
+    header = b'P6\n%d %d\n255\n' % (pix.width, pix.height)
+    return b''.join((header, pix.samples_mv)), pix.width, pix.height
+
+
+def render_page_bitmap(document, page_index, zoom):
+    """Rasteriza una página completa como PPM.
+
+    No toca Tk, así que puede ejecutarse en el hilo de renderizado.
+    """
+    page = document[page_index]
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return pixmap_to_ppm(pix)
+
+
+def image_to_ppm(img):
+    """Devuelve (datos PPM, ancho, alto) de una imagen PIL"""
+    img = img.convert('RGB')
+    header = b'P6\n%d %d\n255\n' % img.size
+    return header + img.tobytes(), img.width, img.height
+
+
+def render_tile_bitmap(document, page_index, zoom, col, row, tile_size=TILE_SIZE):
+    """Rasteriza solo la tesela (col, row) de una página usando un recorte.
+
+    El recorte se expresa en puntos de la página, así MuPDF no procesa
+    más área que la de la propia tesela.
+    """
+    page = document[page_index]
+    x0 = col * tile_size / zoom
+    y0 = row * tile_size / zoom
+    clip = fitz.Rect(x0, y0, x0 + tile_size / zoom, y0 + tile_size / zoom) & page.rect
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+    return pixmap_to_ppm(pix)
+
+
+class DiskRenderCache:
+    """Caché persistente en disco de mapas de bits renderizados.
+
+    Guarda cada PPM comprimido con zlib en un archivo cuyo nombre es un
+    hash de la clave (que incluye el hash del contenido del PDF, así que
+    sirve entre sesiones aunque el archivo cambie de ruta). La fecha de
+    modificación de cada archivo hace de marca LRU: al leerlo se actualiza
+    y, al superar el tope, se borran primero los más antiguos. Se usa
+    desde el hilo de renderizado, de ahí el cerrojo.
+    """
+
+    SUFFIX = '.ppmz'
+
+    def __init__(self, directory, max_mb=DISK_CACHE_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # Índice en memoria de los archivos existentes, del más antiguo al más reciente
+        found = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(self.SUFFIX) and entry.is_file():
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self.total_bytes = sum(self.entries.values())
+        with self.lock:
+            self._trim()
+
+    def filename(self, key):
+        return hashlib.sha1(repr(key).encode()).hexdigest() + self.SUFFIX
+
+    def get(self, key):
+        """Devuelve (datos PPM, ancho, alto) o None si no está en disco"""
+        name = self.filename(key)
+        with self.lock:
+            if name not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                ppm = zlib.decompress(f.read())
+            os.utime(path)
+            _, size, _ = ppm.split(b'\n', 2)
+            width, height = map(int, size.split())
+        except (OSError, ValueError, zlib.error):
+            # Archivo borrado o dañado: se trata como ausente
+            with self.lock:
+                self.total_bytes -= self.entries.pop(name, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return ppm, width, height
+
+    def put(self, key, bitmap):
+        ppm = bitmap[0]
+        data = zlib.compress(ppm, 3)
+        name = self.filename(key)
+        path = os.path.join(self.directory, name)
+        # Escritura atómica: otra sesión nunca ve un archivo a medias
+        tmp_path = temp_path_near(path)
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error al guardar en la caché de disco: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            self.total_bytes -= self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.total_bytes += len(data)
+            self._trim()
+
+    def _trim(self):
+        while self.entries and self.total_bytes > self.max_bytes:
+            name, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def render_cached(disk_cache, key, func, *args):
+    """Lee el mapa de bits de la caché en disco o lo renderiza y lo guarda"""
+    bitmap = disk_cache.get(key)
+    if bitmap is None:
+        bitmap = func(*args)
+        disk_cache.put(key, bitmap)
+    return bitmap
+
+
+def disk_render_key(content_hash, func, args):
+    """Clave en la caché en disco del trabajo de renderizado (func, args).
+
+    Usa el hash del contenido en lugar del documento abierto (args[0]) y
+    redondea el zoom para que sea estable entre sesiones.
+    """
+    return (content_hash, func.__name__) + tuple(
+        round(a, 3) if isinstance(a, float) else a for a in args[1:])
+
+
+def disk_render_job(disk_cache, content_hash, func, args):
+    """Envuelve un trabajo de renderizado (func, args) para pasar por la caché en disco"""
+    if disk_cache is None or content_hash is None:
+        return func, args
+    return render_cached, (disk_cache, disk_render_key(content_hash, func, args), func) + tuple(args)
+
+
+def default_cache_dir():
+    """Carpeta de caché del usuario para la caché de renderizado en disco"""
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'firmador', 'render')
+
+
+def decode_image(data, name):
+    """Pirámide de la imagen codificada en data; ValueError si no se puede leer"""
+    try:
+        return build_mipmaps(Image.open(io.BytesIO(data)))
+    except Exception as e:
+        raise ValueError(f"Imagen no válida: {name} ({e})") from e
+
+
+def build_mipmaps(img):
+    """Devuelve la imagen y sus reducciones sucesivas a la mitad"""
+    img.load()
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        # reduce() no admite paletas ni modos de 1 bit
+        img = img.convert('RGBA')
+    levels = [img]
+    while min(levels[-1].size) >= MIPMAP_MIN_SIZE * 2:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def is_photographic(img):
+    """True si parece una fotografía (muchos colores, sin transparencia): esas
+    se codifican en JPEG; el dibujo lineal y las firmas con alfa, sin pérdida"""
+    if 'A' in img.getbands() and img.getchannel('A').getextrema()[0] < 255:
+        return False
+    if 'transparency' in img.info:
+        return False
+    sample = img.convert('RGB')
+    sample.thumbnail((64, 64))
+    return sample.getcolors(256) is None
+
+
+class AssetStore:
+    """Almacén de imágenes direccionado por el hash de su contenido.
+
+    Cada imagen distinta se decodifica una sola vez y la comparten todos los
+    elementos que la usan. Los bytes codificados y el lector de reportlab se
+    conservan entre guardados mientras el recurso no cambie. Las firmas
+    dibujadas guardan además su geometría (VectorSignature).
+
+    Quien usa un recurso lo retiene (retain) y lo suelta al dejar de usarlo
+    (release); al soltar la última referencia se descarta con su pirámide y
+    sus lectores.
+    """
+
+    def __init__(self):
+        self.encoded = {}
+        self.pyramids = {}
+        self.readers = {}
+        self.path_ids = {}
+        self.vectors = {}
+        self.placed = {}
+        self.refs = {}
+
+    def add(self, content):
+        """Registra una ruta o una imagen PIL y devuelve su identificador"""
+        if isinstance(content, str):
+            return self.add_path(content)
+        return self.add_image(content)
+
+    def add_path(self, path):
+        # Un archivo modificado (fecha o tamaño) se vuelve a leer
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        asset_id = self.path_ids.get(key)
+        if asset_id is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Se decodifica ya: una imagen dañada falla aquí y no al exportar
+            levels = decode_image(data, path)
+            asset_id = self._register(data)
+            self.pyramids.setdefault(asset_id, levels)
+            self.path_ids[key] = asset_id
+        return asset_id
+
+    def add_image(self, img):
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        asset_id = self._register(buf.getvalue())
+        if asset_id not in self.pyramids:
+            # Ya está decodificada: no hace falta volver a abrir el PNG
+            self.pyramids[asset_id] = build_mipmaps(img)
+        return asset_id
+
+    def placed_reader(self, asset_id, width, height, dpi):
+        """Lector de la imagen reducida a dpi para el tamaño (en puntos) con que se dibuja.
+
+        Devuelve (lector, bytes codificados); si reducir no ahorra nada se
+        usa el original. El resultado se guarda por (recurso, tamaño, dpi).
+        """
+        key = (asset_id, round(width, 1), round(height, 1), dpi)
+        cached = self.placed.get(key)
+        if cached is not None:
+            return cached
+        source = self.pyramid(asset_id)[0]
+        original = len(self.encoded[asset_id])
+        # Como drawImage con preserveAspectRatio, la imagen cabe entera en la caja
+        scale = min(width / source.width, height / source.height) * dpi / 72
+        size = (max(1, math.ceil(source.width * scale)), max(1, math.ceil(source.height * scale)))
+        result = (self.reader(asset_id), original)
+        if size[0] < source.width and size[1] < source.height:
+            img = source.resize(size, Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            if is_photographic(img):
+                img.convert('RGB').save(buf, format='JPEG', quality=EXPORT_JPEG_QUALITY, optimize=True)
+            else:
+                # reportlab lo incrusta con Flate; el PNG da una buena estimación
+                img.save(buf, format='PNG', optimize=True)
+            if buf.tell() < original:
+                result = (rl_utils.ImageReader(io.BytesIO(buf.getvalue())), buf.tell())
+        self.placed[key] = result
+        return result
+
+    def add_vector(self, asset_id, vector):
+        """Asocia a una imagen los trazos de la firma de la que se rasterizó"""
+        self.vectors[asset_id] = vector
+
+    def retain(self, asset_id):
+        self.refs[asset_id] = self.refs.get(asset_id, 0) + 1
+
+    def release(self, asset_id):
+        count = self.refs.get(asset_id, 0) - 1
+        if count > 0:
+            self.refs[asset_id] = count
+            return
+        self.refs.pop(asset_id, None)
+        self.discard(asset_id)
+
+    def discard(self, asset_id):
+        """Olvida el recurso y todo lo que se derivó de él"""
+        self.encoded.pop(asset_id, None)
+        self.pyramids.pop(asset_id, None)
+        self.readers.pop(asset_id, None)
+        self.vectors.pop(asset_id, None)
+        self.path_ids = {key: value for key, value in self.path_ids.items() if value != asset_id}
+        self.placed = {key: value for key, value in self.placed.items() if key[0] != asset_id}
+
+    def _register(self, data):
+        asset_id = hashlib.sha256(data).hexdigest()
+        self.encoded.setdefault(asset_id, data)
+        return asset_id
+
+    def pyramid(self, asset_id):
+        levels = self.pyramids.get(asset_id)
+        if levels is None:
+            levels = build_mipmaps(Image.open(io.BytesIO(self.encoded[asset_id])))
+            self.pyramids[asset_id] = levels
+        return levels
+
+    def reader(self, asset_id):
+        """Lector de reportlab reutilizable (guarda los píxeles ya decodificados)"""
+        reader = self.readers.get(asset_id)
+        if reader is None:
+            reader = rl_utils.ImageReader(io.BytesIO(self.encoded[asset_id]))
+            self.readers[asset_id] = reader
+        return reader
+
+
+def resample_from_pyramid(levels, size, fast):
+    """Escala desde el nivel más pequeño que aún cubra el tamaño pedido.
+
+    Durante el arrastre se usa un filtro bilineal barato; la pasada final
+    de calidad usa LANCZOS sobre la imagen original.
+    """
+    if not fast:
+        return levels[0].resize(size, Image.Resampling.LANCZOS)
+    source = levels[0]
+    for level in levels[1:]:
+        if level.width < size[0] or level.height < size[1]:
+            break
+        source = level
+    return source.resize(size, Image.Resampling.BILINEAR)
+
+
+class RenderWorker:
+    """Hilo de rasterización en segundo plano.
+
+    Los trabajos salen por prioridad (la página visible antes que la
+    precarga) y los de una generación anterior a la última cancelación se
+    descartan sin renderizar. MuPDF no admite varios hilos sobre el mismo
+    documento, así que cada worker tiene un único hilo y cualquier otro
+    acceso al documento debe tomar ``lock`` (que se puede compartir entre
+    workers del mismo documento).
+    """
+
+    PRIORITY_VISIBLE = 0
+    PRIORITY_PREFETCH = 1
+
+    def __init__(self, lock=None):
+        self.lock = lock or threading.Lock()
+        self.jobs = queue.PriorityQueue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.pending = {}
+        self._pending_lock = threading.Lock()
+        self._seq = itertools.count()
+        self.thread = threading.Thread(target=self._run, name='render-worker', daemon=True)
+        self.thread.start()
+
+    def submit(self, key, func, args, priority):
+        with self._pending_lock:
+            current = self.pending.get(key)
+            # Ya encolado con igual o mejor prioridad
+            if current is not None and current <= priority:
+                return
+            self.pending[key] = priority
+            self.jobs.put((priority, next(self._seq), self.generation, key, (func, args)))
+
+    def cancel(self):
+        """Invalida todos los trabajos encolados hasta ahora"""
+        with self._pending_lock:
+            self.generation += 1
+            self.pending.clear()
+
+    def drain(self):
+        """Devuelve los resultados terminados como (clave, mapa de bits, error)"""
+        done = []
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        with self._pending_lock:
+            for key, _, _ in done:
+                self.pending.pop(key, None)
+        return done
+
+    def shutdown(self):
+        self.jobs.put((-1, next(self._seq), None, None, None))
+
+    def _run(self):
+        while True:
+            _, _, generation, key, job = self.jobs.get()
+            if key is None:
+                break
+            with self._pending_lock:
+                stale = generation != self.generation or key not in self.pending
+            if stale:
+                continue
+            func, args = job
+            try:
+                with self.lock:
+                    result = func(*args)
+                self.results.put((key, result, None))
+            except Exception as e:
+                self.results.put((key, None, e))
+
+
+class SpatialGrid:
+    """Índice espacial en rejilla uniforme sobre las cajas de los elementos,
+    en puntos de la página (no cambian con el zoom).
+
+    Cada elemento se apunta en las celdas que toca su caja, de modo que una
+    consulta solo examina los elementos de las celdas que cubre y no todos
+    los de la página.
+    """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.boxes = {}
+        self.spans = {}
+        self.order = {}
+        self._z = itertools.count()
+
+    def _span(self, bbox):
+        cs = self.cell_size
+        x1, y1, x2, y2 = bbox
+        return int(x1 // cs), int(y1 // cs), int(x2 // cs), int(y2 // cs)
+
+    def _cells(self, span):
+        c0, r0, c1, r1 = span
+        for c in range(c0, c1 + 1):
+            for r in range(r0, r1 + 1):
+                yield c, r
+
+    def insert(self, item, bbox):
+        if item in self.boxes:
+            self.update(item, bbox)
+            return
+        span = self._span(bbox)
+        for cell in self._cells(span):
+            self.cells.setdefault(cell, set()).add(item)
+        self.boxes[item] = bbox
+        self.spans[item] = span
+        self.order[item] = next(self._z)
+
+    def update(self, item, bbox):
+        if item not in self.boxes:
+            self.insert(item, bbox)
+            return
+        self.boxes[item] = bbox
+        span = self._span(bbox)
+        if span == self.spans[item]:
+            return
+        self._unlink(item)
+        for cell in self._cells(span):
+            self.cells.setdefault(cell, set()).add(item)
+        self.spans[item] = span
+
+    def remove(self, item):
+        if item not in self.boxes:
+            return
+        self._unlink(item)
+        del self.boxes[item]
+        del self.spans[item]
+        del self.order[item]
+
+    def _unlink(self, item):
+        for cell in self._cells(self.spans[item]):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(item)
+                if not bucket:
+                    del self.cells[cell]
+
+    def raise_item(self, item):
+        if item in self.order:
+            self.order[item] = next(self._z)
+
+    def query_point(self, x, y):
+        """Elemento más alto cuya caja contiene el punto, o None"""
+        cs = self.cell_size
+        best = None
+        for item in self.cells.get((int(x // cs), int(y // cs)), ()):
+            x1, y1, x2, y2 = self.boxes[item]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                if best is None or self.order[item] > self.order[best]:
+                    best = item
+        return best
+
+    def query_rect(self, x1, y1, x2, y2):
+        """Elementos cuya caja corta el rectángulo, de abajo arriba"""
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        found = set()
+        for cell in self._cells(self._span((x1, y1, x2, y2))):
+            for item in self.cells.get(cell, ()):
+                if item in found:
+                    continue
+                bx1, by1, bx2, by2 = self.boxes[item]
+                if bx1 <= x2 and x1 <= bx2 and by1 <= y2 and y1 <= by2:
+                    found.add(item)
+        return sorted(found, key=self.order.get)
+
+    def __contains__(self, item):
+        return item in self.boxes
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+class PdfDocument:
+    """PDF analizado una sola vez y compartido por el visor y la exportación.
+
+    MuPDF lo abre sobre el archivo (lee del disco lo que necesita, no lo
+    carga entero) y PyPDF2 sobre un descriptor abierto a la vez. Los dos se
+    conservan entre guardados: exportar no vuelve a analizar el documento y
+    siempre parte de lo que se está mostrando, también después de guardar
+    encima del original, porque los descriptores siguen apuntando a él.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        # Uno para copiar y calcular el hash, otro para el lector de PyPDF2:
+        # cada uno con su posición, así pueden usarse desde hilos distintos
+        self.file = open(self.path, 'rb')
+        self._reader_file = open(self.path, 'rb')
+        self.file_lock = threading.Lock()
+        st = os.fstat(self.file.fileno())
+        # Identidad del documento para la caché: ruta + fecha + tamaño
+        self.key = (self.path, st.st_mtime_ns, st.st_size)
+        try:
+            self.doc = fitz.open(self.path)
+        except BaseException:
+            self.file.close()
+            self._reader_file.close()
+            raise
+        self._reader = None
+        self._content_hash = None
+
+    def __len__(self):
+        return len(self.doc)
+
+    @property
+    def content_hash(self):
+        """Hash del contenido, para cachés que sobreviven a la sesión"""
+        if self._content_hash is None:
+            digest = hashlib.sha256()
+            with self.file_lock:
+                self.file.seek(0)
+                for block in iter(lambda: self.file.read(1024 * 1024), b''):
+                    digest.update(block)
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def copy_to(self, path):
+        """Copia a path el archivo tal como se abrió"""
+        with self.file_lock, open(path, 'wb') as f:
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, f)
+
+    def reader(self):
+        """Lector de PyPDF2 sobre el archivo abierto, creado la primera vez que se pide"""
+        if self._reader is None:
+            self._reader = PyPDF2.PdfReader(self._reader_file)
+        return self._reader
+
+    def close(self):
+        self.doc.close()
+        self.file.close()
+        self._reader_file.close()
+
+
+def overlay_placement(page):
+    """Tamaño y colocación de la superposición de una página de PyPDF2.
+
+    Los elementos están en la página tal como se ve (el CropBox con /Rotate
+    aplicado, como la muestra MuPDF). Devuelve ((ancho, alto) de esa vista,
+    matriz que lleva la superposición dibujada a ese tamaño al espacio del
+    PDF), o None como matriz si ya coinciden, que es lo habitual.
+    """
+    box = page.cropbox
+    x0, y0, x1, y1 = float(box.left), float(box.bottom), float(box.right), float(box.top)
+    width, height = x1 - x0, y1 - y0
+    rotation = (page.rotation or 0) % 360
+    if rotation == 90:
+        return (height, width), (0, 1, -1, 0, x1, y0)
+    if rotation == 180:
+        return (width, height), (-1, 0, 0, -1, x1, y1)
+    if rotation == 270:
+        return (height, width), (0, -1, 1, 0, x0, y1)
+    return (width, height), (None if x0 == y0 == 0 else (1, 0, 0, 1, x0, y0))
+
+
+def temp_path_near(path):
+    """Archivo temporal en la misma carpeta que path, para renombrarlo de forma atómica"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    return tmp_path
+
+
+class ExportCancelled(Exception):
+    """La exportación se canceló desde la interfaz"""
+
+
+class MemoryBudget:
+    """Límite de lo que puede crecer la memoria durante una exportación.
+
+    La memoria residente no baja aunque Python libere objetos, así que estar
+    por encima del límite no basta para fallar: solo cuenta lo que sigue
+    subiendo desde la última decisión. Si sube, la tanda se reduce a la
+    mitad; si sigue subiendo con tandas de una página, se aborta.
+    """
+
+    def __init__(self, limit_mb):
+        self.limit_mb = limit_mb
+        self.start_mb = memory_usage_mb()
+        self.reference_mb = self.start_mb
+
+    def next_chunk(self, chunk):
+        """Tamaño de la siguiente tanda después de escribir una de chunk páginas"""
+        if self.start_mb is None:
+            return chunk
+        now = memory_usage_mb()
+        if now - self.start_mb <= self.limit_mb:
+            self.reference_mb = now
+            return chunk
+        gc.collect()
+        now = memory_usage_mb()
+        if now <= self.reference_mb + self.limit_mb * EXPORT_MEMORY_SLACK:
+            # Por encima del límite pero estable: memoria ya liberada que el proceso conserva
+            return chunk
+        if chunk == 1:
+            raise MemoryError(f"La exportación superó el límite de {self.limit_mb} MB")
+        self.reference_mb = now
+        return chunk // 2
+
+
+class ExportProgress:
+    """Avance de una exportación y petición de cancelación.
+
+    El hilo que exporta llama a step() por cada página; la interfaz lee
+    done/total y puede pedir cancel(), que se hace efectivo en el
+    siguiente step().
+    """
+
+    def __init__(self):
+        self.done = 0
+        self.total = 0
+        self.cancel_event = threading.Event()
+        # Imagen incrustada -> (bytes del original, bytes escritos)
+        self.images = {}
+        # Elementos que no se pudieron dibujar; el resto del PDF sí se guarda
+        self.errors = []
+
+    def set_total(self, total):
+        self.total = total
+
+    def step(self):
+        if self.cancel_event.is_set():
+            raise ExportCancelled()
+        self.done += 1
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def add_image(self, key, original, written):
+        self.images[key] = (original, written)
+
+    def add_error(self, message):
+        self.errors.append(message)
+
+    def image_bytes(self):
+        """(bytes originales, bytes escritos) de las imágenes distintas exportadas"""
+        return (sum(o for o, _ in self.images.values()),
+                sum(w for _, w in self.images.values()))
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class ExportJob:
+    """Ejecuta una exportación en un hilo aparte"""
+
+    def __init__(self, func, *args):
+        self.progress = ExportProgress()
+        self.error = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._run, args=(func, args), name='export', daemon=True)
+        self.thread.start()
+
+    def _run(self, func, args):
+        try:
+            func(*args, progress=self.progress)
+        except ExportCancelled:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+
+    def finished(self):
+        return not self.thread.is_alive()
+
+
+def memory_usage_mb():
+    """Memoria residente del proceso en MB, o None si no se puede medir"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                    'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                    'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize / (1024 * 1024)
+    return None
+
+
+class StreamingPdfWriter:
+    """Escribe un PDF página a página sin retener el documento en memoria.
+
+    Cada página se serializa al añadirla junto con los objetos que usa y
+    todavía no se habían escrito; en memoria solo quedan los números de
+    objeto y los desplazamientos para la tabla xref. Las imágenes (y los
+    formularios autocontenidos, como las firmas vectoriales) con el mismo
+    contenido se escriben una sola vez aunque vengan de lectores distintos
+    (por ejemplo, las superposiciones de cada tanda de páginas).
+    """
+
+    def __init__(self, stream, source):
+        self.stream = stream
+        self.offsets = [None]
+        self.numbers = {}
+        self.images = {}
+        self.pending = []
+        self.kids = []
+        self.pages_num = self.allocate()
+        self.root_num = self.allocate()
+        header = getattr(source, 'pdf_header', None) or '%PDF-1.7'
+        stream.write(header.encode('latin-1') + b'\n%\xe2\xe3\xcf\xd3\n')
+        # Las páginas del original se numeran de antemano: así las
+        # referencias cruzadas (anotaciones, destinos) no arrastran la página
+        # entera antes de tiempo
+        numbers = self.numbers_for(source)
+        for page in source.pages:
+            ref = page.indirect_reference
+            numbers[(ref.idnum, ref.generation)] = self.allocate()
+
+    def allocate(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def numbers_for(self, reader):
+        return self.numbers.setdefault(id(reader), {})
+
+    def forget(self, reader):
+        """Olvida los objetos de un lector que ya no se va a usar"""
+        self.numbers.pop(id(reader), None)
+
+    def add_page(self, page):
+        ref = page.indirect_reference
+        num = self.numbers_for(ref.pdf)[(ref.idnum, ref.generation)]
+        out = self.copy(page)
+        out[generic.NameObject('/Parent')] = generic.IndirectObject(self.pages_num, 0, None)
+        self.write_object(num, out)
+        self.kids.append(num)
+        while self.pending:
+            num, obj = self.pending.pop()
+            self.write_object(num, self.copy_object(obj))
+
+    def reference(self, ref):
+        numbers = self.numbers_for(ref.pdf)
+        key = (ref.idnum, ref.generation)
+        num = numbers.get(key)
+        if num is None:
+            obj = ref.get_object()
+            if isinstance(obj, generic.DictionaryObject) and obj.get('/Type') == '/Pages':
+                num = self.pages_num
+            else:
+                digest = self.xobject_digest(obj)
+                num = self.images.get(digest) if digest else None
+                if num is None:
+                    num = self.allocate()
+                    self.pending.append((num, obj))
+                    if digest:
+                        self.images[digest] = num
+            numbers[key] = num
+        return generic.IndirectObject(num, 0, None)
+
+    def xobject_digest(self, obj):
+        if not isinstance(obj, generic.StreamObject):
+            return None
+        if obj.get('/Subtype') == '/Form':
+            return self.form_digest(obj)
+        if obj.get('/Subtype') != '/Image':
+            return None
+        h = hashlib.sha256(obj._data)
+        for key in ('/Width', '/Height', '/BitsPerComponent', '/ColorSpace', '/Filter', '/DecodeParms'):
+            h.update(repr(obj.get(key)).encode())
+        mask = obj.get('/SMask')
+        if mask is not None:
+            h.update((self.xobject_digest(mask.get_object()) or '').encode())
+        return h.hexdigest()
+
+    def form_digest(self, obj):
+        """Huella de un formulario que no usa más recursos que fuentes estándar;
+        los demás no se comparan"""
+        h = hashlib.sha256(obj._data)
+        for key in ('/BBox', '/Matrix', '/Filter'):
+            h.update(repr(obj.get(key)).encode())
+        resources = obj.get('/Resources')
+        resources = resources.get_object() if resources is not None else {}
+        for key, value in resources.items():
+            value = value.get_object()
+            if key == '/ProcSet':
+                h.update(repr(value).encode())
+                continue
+            if key != '/Font':
+                return None
+            for name, font in value.items():
+                font = font.get_object()
+                if '/FontDescriptor' in font:
+                    return None
+                h.update(repr((name, font.get('/BaseFont'), font.get('/Encoding'))).encode())
+        return h.hexdigest()
+
+    def copy_object(self, obj):
+        """Copia un objeto indirecto traduciendo sus referencias a la numeración de salida"""
+        if isinstance(obj, generic.StreamObject):
+            out = generic.EncodedStreamObject()
+            for key, value in obj.items():
+                out[generic.NameObject(key)] = self.copy(value)
+            if isinstance(obj, generic.DecodedStreamObject):
+                # Contenido sin comprimir (p. ej. el resultado de merge_page)
+                out[generic.NameObject('/Filter')] = generic.NameObject('/FlateDecode')
+                out.pop('/DecodeParms', None)
+                out._data = zlib.compress(obj.get_data())
+            else:
+                out._data = obj._data
+            return out
+        return self.copy(obj)
+
+    def copy(self, obj):
+        if isinstance(obj, generic.IndirectObject):
+            return self.reference(obj)
+        if isinstance(obj, generic.StreamObject):
+            # Un flujo siempre va como objeto indirecto (merge_page los deja directos)
+            num = self.allocate()
+            self.pending.append((num, obj))
+            return generic.IndirectObject(num, 0, None)
+        if isinstance(obj, generic.DictionaryObject):
+            out = generic.DictionaryObject()
+            for key, value in obj.items():
+                out[generic.NameObject(key)] = self.copy(value)
+            return out
+        if isinstance(obj, generic.ArrayObject):
+            return generic.ArrayObject(self.copy(value) for value in obj)
+        if obj is None:
+            return generic.NullObject()
+        return obj
+
+    def write_object(self, num, obj):
+        self.offsets[num] = self.stream.tell()
+        self.stream.write(b'%d 0 obj\n' % num)
+        obj.write_to_stream(self.stream, None)
+        self.stream.write(b'\nendobj\n')
+
+    def close(self):
+        """Escribe el árbol de páginas, el catálogo y la tabla xref"""
+        pages = generic.DictionaryObject()
+        pages[generic.NameObject('/Type')] = generic.NameObject('/Pages')
+        pages[generic.NameObject('/Kids')] = generic.ArrayObject(
+            generic.IndirectObject(num, 0, None) for num in self.kids)
+        pages[generic.NameObject('/Count')] = generic.NumberObject(len(self.kids))
+        self.write_object(self.pages_num, pages)
+        root = generic.DictionaryObject()
+        root[generic.NameObject('/Type')] = generic.NameObject('/Catalog')
+        root[generic.NameObject('/Pages')] = generic.IndirectObject(self.pages_num, 0, None)
+        self.write_object(self.root_num, root)
+
+        xref = self.stream.tell()
+        self.stream.write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self.offsets))
+        for offset in self.offsets[1:]:
+            self.stream.write(b'%010d 00000 n \n' % offset)
+        self.stream.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                          % (len(self.offsets), self.root_num, xref))
+
+
+class PdfExporter:
+    """Superpone los elementos sobre un PDF y escribe el resultado.
+
+    No depende de Tk: lo usan tanto la interfaz (en un hilo aparte) como el
+    modo por lotes. Los elementos llegan agrupados por página como
+    ElementSnapshot; x, y, ancho, alto y tamaño de fuente están en puntos
+    PDF con origen arriba a la izquierda.
+
+    Al reescribir, las páginas se procesan y vuelcan en tandas de
+    chunk_pages; max_memory_mb limita lo que puede crecer la memoria del
+    proceso durante la exportación (None, sin límite). Con image_dpi, cada
+    imagen se reduce a esa resolución para el tamaño con que se coloca.
+    """
+
+    def __init__(self, asset_store, lock=None, chunk_pages=EXPORT_CHUNK_PAGES, max_memory_mb=None,
+                 image_dpi=None):
+        self.asset_store = asset_store
+        self.lock = lock or threading.Lock()
+        self.chunk_pages = chunk_pages
+        self.max_memory_mb = max_memory_mb
+        self.image_dpi = image_dpi
+
+    def export_pdf(self, document, path, by_page, incremental, progress=None):
+        """Exporta en modo incremental si se pide y es posible; si no, reescribe todo"""
+        progress = progress or ExportProgress()
+        if incremental and self.save_incremental(document, path, by_page, progress):
+            return
+        self.save_rebuild(document, path, by_page, progress)
+
+    def build_overlay(self, pages, progress):
+        """Dibuja con reportlab un PDF con una página por cada (ancho, alto, elementos).
+
+        Todas las páginas editadas van en un mismo documento, así reportlab
+        incrusta cada imagen distinta una sola vez y todas las páginas que la
+        usan comparten el mismo XObject. Las firmas dibujadas se definen del
+        mismo modo una vez, como XObject de formulario con sus trazos.
+        """
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet)
+        forms = set()
+        for pw, ph, page_elements in pages:
+            can.setPageSize((pw, ph))
+            self.draw_overlay_page(can, ph, page_elements, forms, progress)
+            can.showPage()
+            progress.step()
+        can.save()
+        packet.seek(0)
+        return packet
+
+    def draw_overlay_page(self, can, ph, page_elements, forms, progress):
+        for elem in page_elements:
+            # Los elementos ya están en puntos: solo se invierte el eje y
+            x = elem.x
+            y = ph - elem.y
+            
+            if elem.element_type == 'text':
+                # Mapear nombres de fuentes a los nombres válidos de ReportLab
+                font_mapping = {
+                    'Arial': 'Helvetica',
+                    'Helvetica': 'Helvetica',
+                    'Times': 'Times-Roman',
+                    'Courier': 'Courier'
+                }
+                font_name = font_mapping.get(elem.font_family, 'Helvetica')
+                
+                try:
+                    can.setFont(font_name, elem.font_size)
+                    r, g, b = [int(elem.color[j:j+2], 16)/255 for j in (1, 3, 5)]
+                    can.setFillColorRGB(r, g, b)
+                    can.drawString(x, y, elem.content)
+                except Exception as e:
+                    print(f"Error al agregar texto: {e}")
+                    # Usar fuente por defecto si falla
+                    can.setFont('Helvetica', 12)
+                    can.drawString(x, y, elem.content)
+            else:
+                try:
+                    vector = self.asset_store.vectors.get(elem.asset_id)
+                    if vector is not None:
+                        # Firma dibujada: trazos vectoriales, sin imagen que codificar
+                        self.draw_vector_form(can, ph, elem, vector, forms)
+                    else:
+                        img = self.image_reader(elem, progress)
+                        can.drawImage(img, x, y - elem.height, width=elem.width, height=elem.height,
+                                      preserveAspectRatio=True)
+                except Exception as e:
+                    progress.add_error(f"Error al agregar imagen: {e}")
+
+    def image_reader(self, elem, progress):
+        """Lector de la imagen del elemento, reducida a image_dpi si se pidió"""
+        original = len(self.asset_store.encoded[elem.asset_id])
+        if self.image_dpi is None:
+            reader, written = self.asset_store.reader(elem.asset_id), original
+        else:
+            reader, written = self.asset_store.placed_reader(elem.asset_id, elem.width, elem.height,
+                                                             self.image_dpi)
+        progress.add_image(id(reader), original, written)
+        return reader
+
+    def draw_vector_form(self, can, ph, elem, vector, forms):
+        """Coloca la firma en la caja del elemento, conservando la proporción y
+        centrada como drawImage; el formulario se define la primera vez"""
+        name = 'Firma' + elem.asset_id[:16]
+        if elem.asset_id not in forms:
+            can.beginForm(name, 0, 0, vector.width, vector.height)
+            draw_vector_strokes(can, vector)
+            can.endForm()
+            forms.add(elem.asset_id)
+        scale = min(elem.width / vector.width, elem.height / vector.height)
+        can.saveState()
+        can.translate(elem.x + (elem.width - vector.width * scale) / 2,
+                      ph - elem.y - (elem.height + vector.height * scale) / 2)
+        can.scale(scale, scale)
+        can.doForm(name)
+        can.restoreState()
+
+    def save_rebuild(self, document, path, by_page, progress):
+        """Reescribe el documento completo con PyPDF2, por tandas de páginas.
+
+        Cada tanda construye su superposición, fusiona sus páginas, las
+        escribe y libera todo antes de pasar a la siguiente, así la memoria
+        no crece con el número de páginas.
+        """
+        budget = MemoryBudget(self.max_memory_mb) if self.max_memory_mb else None
+        reader = document.reader()
+        total = len(reader.pages)
+        edited = [i for i in sorted(by_page) if 0 <= i < total]
+        progress.set_total(len(edited) + total + 1)
+        chunk = max(1, self.chunk_pages)
+
+        # Escribir a un temporal y renombrar: cancelar o fallar no deja un archivo a medias
+        tmp_path = temp_path_near(path)
+        try:
+            with open(tmp_path, 'wb') as f:
+                writer = StreamingPdfWriter(f, reader)
+                first = 0
+                while first < total:
+                    last = min(first + chunk, total)
+                    self.write_chunk(reader, writer, range(first, last), by_page, progress)
+                    first = last
+                    if budget is not None:
+                        chunk = budget.next_chunk(chunk)
+                writer.close()
+            progress.step()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def write_chunk(self, reader, writer, indexes, by_page, progress):
+        # Una página de superposición por cada página editada de la tanda, en orden
+        edited = [i for i in indexes if i in by_page]
+        overlay = None
+        overlay_pages = {}
+        if edited:
+            placements = [overlay_placement(reader.pages[i]) for i in edited]
+            overlay = PyPDF2.PdfReader(self.build_overlay(
+                [(pw, ph, by_page[i]) for i, ((pw, ph), _) in zip(edited, placements)], progress))
+            overlay_pages = {i: (page, matrix)
+                             for i, page, (_, matrix) in zip(edited, overlay.pages, placements)}
+
+        for i in indexes:
+            page = reader.pages[i]
+            # Las páginas sin elementos se copian sin superponer nada
+            if i in overlay_pages:
+                overlay_page, matrix = overlay_pages[i]
+                if matrix is not None:
+                    overlay_page.add_transformation(matrix)
+                    # merge_page recorta por la caja de la superposición: la de la página
+                    overlay_page.mediabox = page.mediabox
+                # Se fusiona sobre una copia: el lector se reutiliza en otros guardados
+                merged = PyPDF2.PageObject(reader, page.indirect_reference)
+                merged.update(page)
+                merged.merge_page(overlay_page)
+                page = merged
+            writer.add_page(page)
+            progress.step()
+
+        # Soltar la superposición y los objetos ya escritos de esta tanda
+        if overlay is not None:
+            writer.forget(overlay)
+        reader.resolved_objects.clear()
+
+    def save_incremental(self, document, path, by_page, progress):
+        """Añade una actualización incremental que solo toca las páginas editadas.
+
+        El original se copia tal cual y se le anexan los objetos nuevos, así
+        las páginas sin elementos quedan idénticas byte a byte y el coste
+        depende de las páginas editadas, no del tamaño del documento.
+        Devuelve False si el archivo no admite este modo.
+        """
+        # MuPDF no admite varios hilos a la vez: cada llamada a fitz toma el
+        # cerrojo compartido (en la interfaz, el del worker de renderizado)
+        lock = self.lock
+        with lock:
+            src = document.doc
+            if not src.can_save_incrementally():
+                return False
+            for i in by_page:
+                if not 0 <= i < len(src):
+                    continue
+                page = src[i]
+                # Con rotación o recorte distinto al mediabox las coordenadas no
+                # coinciden; la reescritura completa lleva la superposición al
+                # espacio del PDF (overlay_placement)
+                if page.rotation or page.cropbox != page.mediabox:
+                    return False
+
+        # saveIncr escribe sobre el archivo abierto: se trabaja en una copia del
+        # original junto al destino, también al guardar sobre él, así un fallo no
+        # puede dejarlo a medias. Abrirla solo lee la tabla de referencias
+        tmp_path = temp_path_near(path)
+        try:
+            document.copy_to(tmp_path)
+            with lock:
+                doc = fitz.open(tmp_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        try:
+            with lock:
+                edited = [i for i in sorted(by_page) if 0 <= i < len(doc)]
+                pages = [(doc[i].mediabox.width, doc[i].mediabox.height, by_page[i]) for i in edited]
+            progress.set_total(len(edited) * 2 + 1)
+            if edited:
+                # Un único documento de superposición: sus imágenes se copian una vez
+                packet = self.build_overlay(pages, progress)
+                with lock:
+                    overlay = fitz.open('pdf', packet.getvalue())
+                for k, i in enumerate(edited):
+                    with lock:
+                        doc[i].show_pdf_page(doc[i].rect, overlay, k, overlay=True)
+                    progress.step()
+                with lock:
+                    overlay.close()
+            # Último punto de cancelación: después ya se escribe
+            progress.step()
+            if edited:
+                with lock:
+                    doc.saveIncr()
+        except BaseException:
+            with lock:
+                doc.close()
+            os.remove(tmp_path)
+            raise
+        with lock:
+            doc.close()
+        os.replace(tmp_path, path)
+        return True
+
+
+def warm_up():
+    """Importa de antemano lo que hace falta para abrir y exportar PDF"""
+    for module in (fitz, canvas, rl_utils, PyPDF2, generic):
+        module.load()
+
+
+class Element:
+    """Elemento colocado en una página: texto, imagen o firma.
+
+    La geometría está en puntos PDF con origen arriba a la izquierda de su
+    página. Las imágenes viven en el AssetStore del documento y aquí solo
+    se guarda su identificador; content es el texto de los elementos de texto.
+    """
+
+    def __init__(self, element_type, page, x, y, width=150, height=50, content=None,
+                 font_family='Arial', font_size=12, color='#000000', asset_id=None):
+        self.id = str(uuid.uuid4())
+        self.element_type = element_type
+        self.page = page
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.content = content
+        self.font_family = font_family
+        self.font_size = font_size
+        self.color = color
+        self.asset_id = asset_id
+
+    def bbox(self):
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
+
+    def snapshot(self):
+        return ElementSnapshot(
+            element_type=self.element_type, x=self.x, y=self.y,
+            width=self.width, height=self.height,
+            content=self.content if self.element_type == 'text' else None,
+            font_family=self.font_family, font_size=self.font_size,
+            color=self.color, asset_id=self.asset_id)
+
+
+class SignDocument:
+    """PDF abierto para firmar: el documento, sus elementos y la exportación.
+
+    Es todo lo que hace falta para firmar sin interfaz; la ventana de Tk es
+    una vista sobre él. asset_store y exporter se pueden compartir entre
+    documentos para reutilizar las imágenes ya decodificadas.
+    """
+
+    def __init__(self, path, asset_store=None, exporter=None):
+        self.pdf = PdfDocument(path)
+        if asset_store is None:
+            # Las imágenes tienen que estar en el almacén del que lee el exportador
+            asset_store = exporter.asset_store if exporter is not None else AssetStore()
+        self.asset_store = asset_store
+        self.exporter = exporter or PdfExporter(self.asset_store)
+        self.elements = []
+        self._page_sizes = None
+
+    @property
+    def page_sizes(self):
+        """Tamaño en puntos de cada página, para maquetar sin rasterizar"""
+        if self._page_sizes is None:
+            self._page_sizes = [(p.rect.width, p.rect.height) for p in self.pdf.doc]
+        return self._page_sizes
+
+    def __len__(self):
+        return len(self.pdf)
+
+    def add(self, element):
+        self.elements.append(element)
+        if element.asset_id is not None:
+            self.asset_store.retain(element.asset_id)
+        return element
+
+    def add_text(self, page, x, y, text, **style):
+        return self.add(Element('text', page, x, y, content=text, **style))
+
+    def add_image(self, page, x, y, width, height, image, element_type='image', vector=None):
+        """Añade una imagen (ruta o imagen PIL); vector, para firmas dibujadas"""
+        asset_id = self.asset_store.add(image)
+        if vector is not None:
+            self.asset_store.add_vector(asset_id, vector)
+        return self.add(Element(element_type, page, x, y, width, height, asset_id=asset_id))
+
+    def remove(self, element):
+        if element in self.elements:
+            self.elements.remove(element)
+            if element.asset_id is not None:
+                self.asset_store.release(element.asset_id)
+
+    def clear(self):
+        """Quita todos los elementos y suelta sus imágenes"""
+        for element in list(self.elements):
+            self.remove(element)
+
+    def pages_with_elements(self):
+        return {e.page for e in self.elements}
+
+    def snapshot(self):
+        """Copia del estado de los elementos agrupada por página"""
+        by_page = {}
+        for elem in self.elements:
+            by_page.setdefault(elem.page, []).append(elem.snapshot())
+        return by_page
+
+    def export(self, path, incremental=True, progress=None):
+        self.exporter.export_pdf(self.pdf, path, self.snapshot(), incremental, progress)
+
+    def close(self):
+        self.clear()
+        self.pdf.close()
+
+
+def simplify_stroke(points, tolerance=SIGNATURE_TOLERANCE):
+    """Ramer-Douglas-Peucker sobre puntos (x, y, t): quita los que se apartan
+    menos de tolerance de la recta entre los que se conservan"""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1, _ = points[first]
+        x2, y2, _ = points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        best, index = tolerance, None
+        for i in range(first + 1, last):
+            x, y, _ = points[i]
+            if length:
+                distance = abs(dy * (x - x1) - dx * (y - y1)) / length
+            else:
+                distance = math.hypot(x - x1, y - y1)
+            if distance > best:
+                best, index = distance, i
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def smooth_stroke(points, iterations=2):
+    """Suavizado de Chaikin conservando los extremos, parecido al smooth de Tk"""
+    for _ in range(iterations):
+        if len(points) < 3:
+            break
+        smoothed = [points[0]]
+        for a, b in zip(points, points[1:]):
+            smoothed.append(tuple(0.75 * u + 0.25 * v for u, v in zip(a, b)))
+            smoothed.append(tuple(0.25 * u + 0.75 * v for u, v in zip(a, b)))
+        smoothed[1] = points[0]
+        smoothed[-1] = points[-1]
+        points = smoothed[1:]
+    return points
+
+
+def stroke_widths(points):
+    """Grosor de cada segmento: más fino cuanto más rápido se movió el ratón"""
+    widths = []
+    width = SIGNATURE_STROKE_WIDTH
+    for (x1, y1, t1), (x2, y2, t2) in zip(points, points[1:]):
+        speed = math.hypot(x2 - x1, y2 - y1) / max(t2 - t1, 1)  # píxeles por ms
+        target = max(SIGNATURE_MIN_WIDTH, SIGNATURE_MAX_WIDTH / (1 + speed))
+        # Sin saltos bruscos de grosor entre segmentos vecinos
+        width += (target - width) * 0.5
+        widths.append(width)
+    return widths
+
+
+def rasterize_strokes(strokes, size, variable_width=False, scale=1.0):
+    """Dibuja los trazos (listas de (x, y, t)) en una imagen RGBA transparente;
+    scale multiplica el grosor"""
+    img = Image.new("RGBA", size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    ink = (0, 0, 0, 255)
+    for points in strokes:
+        points = smooth_stroke(points)
+        if variable_width:
+            widths = [w * scale for w in stroke_widths(points)]
+        else:
+            widths = [SIGNATURE_STROKE_WIDTH * scale] * (len(points) - 1)
+        # Extremos y uniones redondeados; un punto suelto queda como un círculo
+        caps = [(points[0], widths[0] if widths else SIGNATURE_STROKE_WIDTH * scale)]
+        for (x1, y1, _), (x2, y2, _), w in zip(points, points[1:], widths):
+            draw.line([x1, y1, x2, y2], fill=ink, width=max(1, round(w)))
+            caps.append(((x2, y2, 0), w))
+        for (x, y, _), w in caps:
+            r = w / 2
+            draw.ellipse([x - r, y - r, x + r, y + r], fill=ink)
+    return img
+
+
+def vector_image(vector, size):
+    """Rasteriza una firma vectorial estirada a size, como la imagen en pantalla"""
+    sx, sy = size[0] / vector.width, size[1] / vector.height
+    strokes = [[(x * sx, y * sy, t) for x, y, t in points] for points in vector.strokes]
+    return rasterize_strokes(strokes, size, vector.variable_width, min(sx, sy))
+
+
+def stroke_bezier(points):
+    """Segmentos cúbicos (Catmull-Rom) que pasan por los puntos del trazo,
+    como (control1, control2, final)"""
+    segments = []
+    for i in range(len(points) - 1):
+        p0 = points[i - 1] if i else points[i]
+        p1, p2 = points[i], points[i + 1]
+        p3 = points[i + 2] if i + 2 < len(points) else p2
+        c1 = (p1[0] + (p2[0] - p0[0]) / 6, p1[1] + (p2[1] - p0[1]) / 6)
+        c2 = (p2[0] - (p3[0] - p1[0]) / 6, p2[1] - (p3[1] - p1[1]) / 6)
+        segments.append((c1, c2, p2))
+    return segments
+
+
+def draw_vector_strokes(can, vector, curves=SIGNATURE_VECTOR_CURVES):
+    """Dibuja los trazos de la firma con operadores de trazado del canvas de
+    reportlab, en sus propias unidades (píxeles de la imagen, y hacia arriba)"""
+
+    def point(p):
+        return p[0], vector.height - p[1]
+
+    can.saveState()
+    can.setStrokeColorRGB(0, 0, 0)
+    can.setFillColorRGB(0, 0, 0)
+    can.setLineCap(1)
+    can.setLineJoin(1)
+    for points in vector.strokes:
+        if len(points) == 1:
+            can.circle(*point(points[0]), SIGNATURE_STROKE_WIDTH / 2, stroke=0, fill=1)
+            continue
+        if vector.variable_width:
+            # Segmentos de grosor parecido comparten un mismo trazado
+            widths = [round(w * 4) / 4 for w in stroke_widths(points)]
+        else:
+            widths = [SIGNATURE_STROKE_WIDTH] * (len(points) - 1)
+        if curves:
+            segments = stroke_bezier(points)
+        else:
+            segments = [(None, None, p) for p in points[1:]]
+        path, current = None, None
+        for start, (c1, c2, end), w in zip(points, segments, widths):
+            if w != current:
+                if path is not None:
+                    can.setLineWidth(current)
+                    can.drawPath(path, stroke=1, fill=0)
+                path, current = can.beginPath(), w
+                path.moveTo(*point(start))
+            if c1 is None:
+                path.lineTo(*point(end))
+            else:
+                path.curveTo(*point(c1), *point(c2), *point(end))
+        can.setLineWidth(current)
+        can.drawPath(path, stroke=1, fill=0)
+    can.restoreState()
+
+
+def load_layout(path):
+    """Lee la plantilla JSON del modo por lotes.
+
+    Formato: {"elements": [{...}, ...]}, con estos campos por elemento:
+      type: 'text', 'date', 'image' o 'signature'
+      page: página desde 1; negativa cuenta desde el final (-1 = última);
+            "all" para todas
+      x, y: esquina superior izquierda en puntos PDF
+      width, height: tamaño en puntos (imágenes y firmas)
+      text, font, font_size, color: para 'text' ('format' de strftime para 'date')
+      path: imagen, relativa a la carpeta de la plantilla
+    """
+    with open(path, encoding='utf-8') as f:
+        layout = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for spec in layout['elements']:
+        if spec.get('type') not in ('text', 'date', 'image', 'signature'):
+            raise ValueError(f"Tipo de elemento no válido: {spec.get('type')!r}")
+        if spec['type'] in ('image', 'signature'):
+            spec['path'] = os.path.join(base, spec['path'])
+            # Una imagen dañada haría fallar todos los archivos: mejor no empezar
+            with open(spec['path'], 'rb') as f:
+                decode_image(f.read(), spec['path'])
+    return layout
+
+
+def layout_pages(spec, total_pages):
+    page = spec.get('page', 1)
+    if page == 'all':
+        return range(total_pages)
+    index = page - 1 if page > 0 else total_pages + page
+    return [index] if 0 <= index < total_pages else []
+
+
+def add_layout(document, layout, today=None):
+    """Añade al SignDocument los elementos de la plantilla en sus páginas"""
+    today = today or datetime.date.today()
+    for spec in layout['elements']:
+        kind = spec['type']
+        if kind == 'date':
+            content = today.strftime(spec.get('format', '%d/%m/%Y'))
+            kind = 'text'
+        else:
+            content = spec.get('text')
+        # La imagen se registra una vez aunque vaya en todas las páginas
+        asset_id = document.asset_store.add(spec['path']) if kind in ('image', 'signature') else None
+        for index in layout_pages(spec, len(document)):
+            document.add(Element(
+                kind, index, spec['x'], spec['y'],
+                width=spec.get('width', 150), height=spec.get('height', 50),
+                content=content, font_family=spec.get('font', 'Arial'),
+                font_size=spec.get('font_size', 12), color=spec.get('color', '#000000'),
+                asset_id=asset_id))
+
+
+# Exportador propio de cada proceso del lote (caché de imágenes incluida)
+_batch_exporter = None
+
+# Imágenes de la plantilla retenidas en ese exportador para todos los archivos
+_batch_assets = set()
+
+
+def _batch_init(max_memory_mb=None, image_dpi=None):
+    global _batch_exporter
+    _batch_exporter = PdfExporter(AssetStore(), max_memory_mb=max_memory_mb, image_dpi=image_dpi)
+
+
+def _batch_sign_file(task):
+    src, dst, layout, incremental = task
+    start = time.perf_counter()
+    progress = ExportProgress()
+    try:
+        document = SignDocument(src, _batch_exporter.asset_store, _batch_exporter)
+        try:
+            add_layout(document, layout)
+            for elem in document.elements:
+                if elem.asset_id is not None and elem.asset_id not in _batch_assets:
+                    _batch_exporter.asset_store.retain(elem.asset_id)
+                    _batch_assets.add(elem.asset_id)
+            document.export(dst, incremental, progress)
+        finally:
+            document.close()
+        if progress.errors:
+            # Falta parte de la firma: no cuenta como hecho y se repetirá
+            raise ValueError('; '.join(progress.errors))
+        status, error = 'ok', None
+    except Exception as e:
+        status, error = 'error', f"{type(e).__name__}: {e}"
+    original, written = progress.image_bytes()
+    return {
+        'file': os.path.basename(src),
+        'status': status,
+        'error': error,
+        'seconds': round(time.perf_counter() - start, 3),
+        'image_bytes_saved': original - written,
+    }
+
+
+def read_batch_report(report_path):
+    """Archivos ya firmados correctamente según un informe anterior"""
+    done = set()
+    if not os.path.exists(report_path):
+        return done
+    with open(report_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Línea cortada por una interrupción
+                continue
+            if entry.get('status') == 'ok':
+                done.add(entry['file'])
+    return done
+
+
+def run_batch(layout_path, input_dir, output_dir, workers=None, report_path=None, incremental=True,
+              max_memory_mb=None, image_dpi=None):
+    """Firma todos los PDF de input_dir con la misma plantilla.
+
+    Usa un proceso por núcleo, escribe una línea JSON por archivo en el
+    informe a medida que terminan y, si se relanza, salta los archivos que
+    ya constan como firmados y cuyo resultado existe.
+    """
+    layout = load_layout(layout_path)
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = report_path or os.path.join(output_dir, 'firmador_report.jsonl')
+    done = read_batch_report(report_path)
+
+    tasks = []
+    skipped = 0
+    for name in sorted(os.listdir(input_dir)):
+        if not name.lower().endswith('.pdf'):
+            continue
+        dst = os.path.join(output_dir, name)
+        if name in done and os.path.exists(dst):
+            skipped += 1
+            continue
+        tasks.append((os.path.join(input_dir, name), dst, layout, incremental))
+
+    counts = {'ok': 0, 'error': 0, 'skipped': skipped}
+    if not tasks:
+        return counts
+    workers = workers or os.cpu_count() or 1
+    with open(report_path, 'a', encoding='utf-8') as report, \
+            multiprocessing.Pool(min(workers, len(tasks)), initializer=_batch_init,
+                                 initargs=(max_memory_mb, image_dpi)) as pool:
+        for n, result in enumerate(pool.imap_unordered(_batch_sign_file, tasks), 1):
+            report.write(json.dumps(result, ensure_ascii=False) + '\n')
+            report.flush()
+            counts[result['status']] += 1
+            line = f"[{n}/{len(tasks)}] {result['file']}: {result['status']}"
+            if result['error']:
+                line += f" ({result['error']})"
+            print(line, flush=True)
+    return counts
\ No newline at end of file